@@ -0,0 +1,62 @@
+"""Compare the FUSE filesystem with tmpfs.
+
+The same generated tree is mounted with :class:`Sysfs` and copied to a
+directory on tmpfs, then the same workloads run on both. The ratio shows how
+much the FUSE and Python layers add on top of the kernel's own file system
+overhead. Example::
+
+    python benchmarks/bench_baseline.py --json build/baseline.json
+"""
+
+import argparse
+import tempfile
+
+from ev3dev.testfs import Sysfs
+
+from common import summarize, write_json
+from treegen import make_tree, materialize
+from workloads import WORKLOADS
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tmpfs', default='/dev/shm',
+                        help='directory on tmpfs for the baseline')
+    parser.add_argument('--devices', type=int, default=16,
+                        help='number of devices in the tree')
+    parser.add_argument('--repeat', type=int, default=10000,
+                        help='number of times each operation is repeated')
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+
+    tree = make_tree(args.devices)
+    results = {}
+
+    with tempfile.TemporaryDirectory(dir=args.tmpfs) as baseline, \
+            tempfile.TemporaryDirectory() as mount_point:
+        materialize(tree, baseline)
+        with Sysfs(mount_point) as sysfs:
+            sysfs.tree = tree
+            for name, workload in WORKLOADS.items():
+                fuse = summarize(workload(mount_point, args.repeat))
+                tmpfs = summarize(workload(baseline, args.repeat))
+                results[name] = {
+                    'sysfs': fuse,
+                    'tmpfs': tmpfs,
+                    'ratio_p50': fuse['p50_us'] / tmpfs['p50_us'],
+                    'ratio_mean': fuse['mean_us'] / tmpfs['mean_us'],
+                }
+
+    print('{:<20} {:>12} {:>12} {:>8}'.format(
+        'operation', 'sysfs p50', 'tmpfs p50', 'ratio'))
+    for name, r in results.items():
+        print('{:<20} {:>10.1f}us {:>10.1f}us {:>7.1f}x'.format(
+            name, r['sysfs']['p50_us'], r['tmpfs']['p50_us'],
+            r['ratio_p50']))
+
+    if args.json:
+        write_json(args.json, {'devices': args.devices, 'results': results})
+
+
+if __name__ == '__main__':
+    main()
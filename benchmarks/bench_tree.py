@@ -0,0 +1,118 @@
+"""Measure how tree operations scale with the size of the tree.
+
+Example::
+
+    python benchmarks/bench_tree.py --devices 4 64 1024 --json build/tree.json
+
+Lookups and readdir are measured by calling :class:`SysfsFuse` directly, so
+they only include the cost of the server code. GET and SET are measured
+through a mounted :class:`Sysfs`, so they include the control pipe.
+"""
+
+import argparse
+import random
+import tempfile
+import tracemalloc
+
+from ev3dev.testfs import Sysfs
+from ev3dev.testfs._sysfs import SysfsFuse
+from ev3dev.testfs._util import encode_dict, decode_dict
+
+from common import measure, summarize, write_json, print_table
+from treegen import make_tree, attribute_paths, directory_paths
+
+
+def tree_memory(encoded: str) -> int:
+    """Gets the number of bytes allocated to decode a tree."""
+    tracemalloc.start()
+    try:
+        tree = decode_dict(encoded)
+        size, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del tree
+    return size
+
+
+def bench_server(tree: dict, repeat: int) -> dict:
+    fs = SysfsFuse()
+    fs._root = tree
+    rng = random.Random(0)
+    files = attribute_paths(tree)
+    dirs = directory_paths(tree)
+
+    def get_item():
+        fs._get_item(rng.choice(files))
+
+    def readdir():
+        list(fs.readdir(rng.choice(dirs), 0))
+
+    return {
+        'get_item': summarize(measure(get_item, repeat=repeat)),
+        'readdir': summarize(measure(readdir, repeat=repeat)),
+    }
+
+
+def bench_control(tree: dict, repeat: int) -> dict:
+    with tempfile.TemporaryDirectory() as mount_point:
+        with Sysfs(mount_point) as sysfs:
+            def set_tree():
+                sysfs.tree = tree
+
+            def get_tree():
+                # sysfs.tree is served from the client's cache
+                sysfs.get_subtree('/')
+
+            return {
+                'SET': summarize(measure(set_tree, repeat=repeat)),
+                'GET': summarize(measure(get_tree, repeat=repeat)),
+            }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--devices', type=int, nargs='+',
+                        default=[4, 64, 1024],
+                        help='number of devices, one run per value')
+    parser.add_argument('--attributes', type=int, default=16,
+                        help='number of attributes per device')
+    parser.add_argument('--value-size', type=int, default=8,
+                        help='size of attribute values in bytes')
+    parser.add_argument('--depth', type=int, default=3,
+                        help='depth of device directories under /devices')
+    parser.add_argument('--repeat', type=int, default=1000,
+                        help='number of times each operation is repeated')
+    parser.add_argument('--no-mount', action='store_true',
+                        help='skip the benchmarks that need FUSE')
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+
+    results = {}
+    for devices in args.devices:
+        tree = make_tree(devices, args.attributes, args.value_size,
+                         args.depth)
+        encoded = encode_dict(tree)
+        name = 'devices={}'.format(devices)
+        ops = bench_server(tree, args.repeat)
+        if not args.no_mount:
+            # GET and SET copy the whole tree, so fewer repeats are enough
+            ops.update(bench_control(tree, max(args.repeat // 10, 1)))
+        results[name] = {
+            'nodes': len(directory_paths(tree)) + len(attribute_paths(tree)),
+            'encoded_bytes': len(encoded),
+            'tree_bytes': tree_memory(encoded),
+            'ops': ops,
+        }
+
+        print('{}: {} nodes, {} bytes encoded, {} bytes in memory'.format(
+            name, results[name]['nodes'], results[name]['encoded_bytes'],
+            results[name]['tree_bytes']))
+        print_table(ops)
+        print()
+
+    if args.json:
+        write_json(args.json, results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""Helpers shared by the benchmarks."""
+
+import json
+import time
+
+from typing import Callable, List
+
+
+def measure(func: Callable, *args, repeat: int = 1000) -> List[float]:
+    """Call a function ``repeat`` times.
+
+    Returns
+    -------
+        The duration of each call in seconds.
+    """
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def percentile(samples: List[float], p: float) -> float:
+    """Gets the ``p``-th percentile (0-100) of a list of samples."""
+    ordered = sorted(samples)
+    index = round(p / 100 * (len(ordered) - 1))
+    return ordered[index]
+
+
+def summarize(samples: List[float]) -> dict:
+    """Summarize durations in seconds as microsecond statistics."""
+    return {
+        'n': len(samples),
+        'mean_us': sum(samples) / len(samples) * 1e6,
+        'p50_us': percentile(samples, 50) * 1e6,
+        'p99_us': percentile(samples, 99) * 1e6,
+        'max_us': max(samples) * 1e6,
+    }
+
+
+def write_json(filename: str, results: dict):
+    """Write results to a JSON file."""
+    with open(filename, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def print_table(results: dict):
+    """Print a dictionary of :func:`summarize` results."""
+    print('{:<40} {:>8} {:>10} {:>10} {:>10}'.format(
+        'operation', 'n', 'mean (us)', 'p50 (us)', 'p99 (us)'))
+    for name, r in results.items():
+        print('{:<40} {:>8} {:>10.1f} {:>10.1f} {:>10.1f}'.format(
+            name, r['n'], r['mean_us'], r['p50_us'], r['p99_us']))
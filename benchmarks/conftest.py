@@ -0,0 +1,55 @@
+import os
+
+import pytest
+
+from ev3dev.testfs import Sysfs, __version__
+
+from common import write_json, print_table
+from treegen import make_tree
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup('benchmarks')
+    group.addoption('--bench-json', default='build/benchmarks.json',
+                    help='file where benchmark results are written')
+    group.addoption('--bench-repeat', type=int, default=1000,
+                    help='number of times each operation is repeated')
+    group.addoption('--bench-devices', type=int, default=16,
+                    help='number of devices in the benchmark tree')
+
+
+@pytest.fixture(scope='session')
+def repeat(request) -> int:
+    """The number of times each operation should be repeated."""
+    return request.config.getoption('--bench-repeat')
+
+
+@pytest.fixture(scope='session')
+def tree(request) -> dict:
+    """The tree that is installed in the mounted filesystem."""
+    return make_tree(request.config.getoption('--bench-devices'))
+
+
+@pytest.fixture(scope='session')
+def results(request):
+    """Dictionary of results, written as JSON when all benchmarks are done."""
+    results = {}
+    yield results
+
+    filename = request.config.getoption('--bench-json')
+    os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+    write_json(filename, {
+        'version': __version__,
+        'devices': request.config.getoption('--bench-devices'),
+        'results': results,
+    })
+    print()
+    print_table(results)
+
+
+@pytest.fixture
+def sysfs(tmp_path, tree):
+    """A mounted filesystem with :func:`tree` installed."""
+    with Sysfs(tmp_path) as sysfs:
+        sysfs.tree = tree
+        yield sysfs
@@ -0,0 +1,128 @@
+"""Replay a recorded access log against a fresh mount.
+
+Record a client with :meth:`Sysfs.start_recording` and
+:meth:`Sysfs.stop_recording`, then::
+
+    python benchmarks/replay.py client.log --json build/replay.json
+
+By default the operations are issued as fast as possible. With ``--paced``,
+the recorded time between operations is kept. The kernel makes its own
+lookups and caches attributes, so the operations seen by the server are
+close to, but not exactly, the recorded ones.
+"""
+
+import argparse
+import collections
+import os
+import select
+import tempfile
+import time
+
+from ev3dev.testfs import Sysfs
+from ev3dev.testfs._recorder import loads
+from ev3dev.testfs._util import decode_dict
+
+from common import summarize, write_json, print_table
+
+
+def replay(mount_point: str, records, paced: bool = False) -> dict:
+    """Issue recorded operations on a mounted filesystem.
+
+    Returns
+    -------
+        A mapping of operation names to lists of durations in seconds.
+    """
+    samples = collections.defaultdict(list)
+    # open files by path, most recently opened last
+    files = collections.defaultdict(list)
+    next_time = time.perf_counter()
+
+    def fd_for(path):
+        if files[path]:
+            return files[path][-1]
+        # the file was opened before the recording started
+        fd = os.open(mount_point + path, os.O_RDWR if os.access(
+            mount_point + path, os.W_OK) else os.O_RDONLY)
+        files[path].append(fd)
+        return fd
+
+    for delay, op, path, args in records:
+        if paced:
+            next_time += delay
+            wait = next_time - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+
+        full_path = mount_point + path
+        start = time.perf_counter()
+        try:
+            if op == 'getattr':
+                os.lstat(full_path)
+            elif op == 'readlink':
+                os.readlink(full_path)
+            elif op == 'readdir':
+                os.listdir(full_path)
+            elif op == 'open':
+                files[path].append(os.open(full_path,
+                                           args[0] & os.O_ACCMODE))
+            elif op == 'release':
+                if files[path]:
+                    os.close(files[path].pop())
+            elif op == 'read':
+                os.pread(fd_for(path), *args)
+            elif op == 'write':
+                os.pwrite(fd_for(path), *args)
+            elif op == 'truncate':
+                os.truncate(full_path, *args)
+            elif op == 'poll':
+                p = select.poll()
+                p.register(fd_for(path), select.POLLPRI)
+                p.poll(0)
+            else:
+                continue
+        except OSError:
+            # errors are part of the recorded behavior too
+            pass
+        samples[op].append(time.perf_counter() - start)
+
+    for fds in files.values():
+        for fd in fds:
+            os.close(fd)
+
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('log', help='file saved by Sysfs.stop_recording()')
+    parser.add_argument('--paced', action='store_true',
+                        help='keep the recorded time between operations')
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+
+    with open(args.log) as f:
+        tree, records = loads(f.read())
+
+    with tempfile.TemporaryDirectory() as mount_point:
+        with Sysfs(mount_point) as sysfs:
+            sysfs.tree = decode_dict(tree)
+            start = time.perf_counter()
+            samples = replay(mount_point, records, args.paced)
+            elapsed = time.perf_counter() - start
+
+    count = sum(len(s) for s in samples.values())
+    results = {op: summarize(s) for op, s in samples.items()}
+    print_table(results)
+    print('{} operations in {:.3f} s ({:.0f} ops/s)'.format(
+        count, elapsed, count / elapsed if elapsed else 0))
+
+    if args.json:
+        write_json(args.json, {
+            'operations': count,
+            'elapsed_s': elapsed,
+            'results': results,
+        })
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+"""Run a sustained load against a mounted filesystem and watch its memory.
+
+Reads, writes, polls and notifications are issued in a loop over all
+attributes of a generated tree for ``--duration`` seconds. Every
+``--interval`` seconds the server's memory usage is sampled with
+:meth:`Sysfs.memory_usage`. At the end, everything that grew after the
+warm-up is reported, which points at leaks long before a mount that is kept
+alive for days runs out of memory. Example::
+
+    python benchmarks/soak.py --duration 14400 --json build/soak.json
+
+The exit status is 1 when growth was found.
+"""
+
+import argparse
+import os
+import select
+import sys
+import tempfile
+import time
+
+from typing import List
+
+from ev3dev.testfs import Sysfs
+
+from common import write_json
+from treegen import WRITABLE, make_tree, attribute_paths
+
+
+def load(sysfs: Sysfs, mount_point: str, paths: List[str], until: float
+         ) -> int:
+    """Issue operations on every path in turn until ``until``.
+
+    Returns
+    -------
+        The number of paths that were processed.
+    """
+    count = 0
+    while time.perf_counter() < until:
+        path = paths[count % len(paths)]
+        writable = os.path.basename(path) in WRITABLE
+        fd = os.open(mount_point + path,
+                     os.O_RDWR if writable else os.O_RDONLY)
+        try:
+            os.pread(fd, 4096, 0)
+            if writable:
+                # same length every time, so write data should not grow
+                os.pwrite(fd, b'%d\n' % (count % 10), 0)
+            p = select.poll()
+            p.register(fd, select.POLLPRI)
+            sysfs.notify(path, select.POLLPRI)
+            p.poll(0)
+        finally:
+            os.close(fd)
+        count += 1
+    return count
+
+
+def find_growth(samples: List[dict], rss_limit: int) -> dict:
+    """Compare the first and last sample.
+
+    Parameters
+    ----------
+    samples
+        The results of :meth:`Sysfs.memory_usage`, the first one taken after
+        the warm-up.
+    rss_limit
+        The number of bytes the resident set size may grow by.
+
+    Returns
+    -------
+        A mapping of what grew to ``[first, last]``. Allocation sites found
+        by :mod:`tracemalloc` are called ``'tracemalloc:<site>'``.
+    """
+    first, last = samples[0], samples[-1]
+    growth = {}
+
+    if last['vmrss_bytes'] - first['vmrss_bytes'] > rss_limit:
+        growth['vmrss_bytes'] = [first['vmrss_bytes'], last['vmrss_bytes']]
+
+    # the load touches every path during the warm-up, so none of these
+    # should change afterwards
+    for name, value in last['structures'].items():
+        if value > first['structures'][name]:
+            growth[name] = [first['structures'][name], value]
+
+    if 'tracemalloc' in first and 'tracemalloc' in last:
+        before = {site: size for site, size, _ in first['tracemalloc']['top']}
+        for site, size, _ in last['tracemalloc']['top']:
+            if size - before.get(site, 0) > rss_limit:
+                growth['tracemalloc:' + site] = [before.get(site, 0), size]
+
+    return growth
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--duration', type=float, default=3600,
+                        help='how long to run the load in seconds')
+    parser.add_argument('--interval', type=float, default=60,
+                        help='time between memory samples in seconds')
+    parser.add_argument('--warmup', type=float, default=None,
+                        help='time before the first sample in seconds, '
+                             'one interval by default')
+    parser.add_argument('--devices', type=int, default=16,
+                        help='number of devices in the tree')
+    parser.add_argument('--rss-limit', type=float, default=4,
+                        help='allowed growth of RSS and of each allocation '
+                             'site in MiB')
+    parser.add_argument('--tracemalloc', action='store_true',
+                        help='trace Python allocations in the server, '
+                             'slower but shows where memory goes')
+    parser.add_argument('--json', help='write the samples to this file')
+    args = parser.parse_args()
+
+    warmup = args.interval if args.warmup is None else args.warmup
+    tree = make_tree(args.devices)
+    paths = attribute_paths(tree)
+    samples = []
+    count = 0
+
+    with tempfile.TemporaryDirectory() as mount_point:
+        with Sysfs(mount_point) as sysfs:
+            sysfs.tree = tree
+            if args.tracemalloc:
+                sysfs.trace_allocations()
+
+            start = time.perf_counter()
+            count += load(sysfs, mount_point, paths, start + warmup)
+            end = start + warmup + args.duration
+            while True:
+                usage = sysfs.memory_usage()
+                usage['elapsed_s'] = time.perf_counter() - start
+                usage['operations'] = count
+                samples.append(usage)
+                print('{:>8.0f} s {:>10} paths {:>8.1f} MiB RSS'.format(
+                    usage['elapsed_s'], count,
+                    usage['vmrss_bytes'] / 2 ** 20), flush=True)
+                now = time.perf_counter()
+                if now >= end:
+                    break
+                count += load(sysfs, mount_point, paths,
+                              min(now + args.interval, end))
+
+    growth = find_growth(samples, int(args.rss_limit * 2 ** 20))
+    for name, (first, last) in growth.items():
+        print('GROWTH {}: {} -> {}'.format(name, first, last))
+    if not growth:
+        print('no growth found')
+
+    if args.json:
+        write_json(args.json, {
+            'devices': args.devices,
+            'samples': samples,
+            'growth': growth,
+        })
+
+    sys.exit(1 if growth else 0)
+
+
+if __name__ == '__main__':
+    main()
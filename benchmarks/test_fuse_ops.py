@@ -0,0 +1,146 @@
+"""Latency of FUSE operations and control commands on a mounted Sysfs.
+
+Run with ``python setup.py bench``. Results are written to
+``build/benchmarks.json`` so they can be compared across commits.
+"""
+
+import select
+import threading
+import time
+
+import pytest
+
+from common import measure, summarize
+from workloads import READ_PATH, WORKLOADS
+
+
+@pytest.mark.parametrize('name', WORKLOADS)
+def test_file_ops(sysfs, results, repeat, name):
+    samples = WORKLOADS[name](str(sysfs._mount_point), repeat)
+    results[name] = summarize(samples)
+
+
+def test_poll_wakeup(sysfs, results, repeat):
+    # time from sending NOTIFY until a thread blocked in poll() wakes up
+    f = open(str(sysfs._mount_point) + READ_PATH, 'rb')
+    p = select.poll()
+    p.register(f.fileno(), select.POLLPRI)
+    woke = threading.Event()
+    stop = False
+    wake_times = []
+
+    def poller():
+        while not stop:
+            for fd, events in p.poll(1000):
+                wake_times.append(time.perf_counter())
+                woke.set()
+            f.seek(0)
+            f.read()
+
+    thread = threading.Thread(target=poller)
+    thread.start()
+    samples = []
+    try:
+        # the notifications are a lot slower than the other operations
+        for _ in range(max(repeat // 10, 1)):
+            # give the poller time to block in poll()
+            time.sleep(0.002)
+            woke.clear()
+            start = time.perf_counter()
+            sysfs.notify(READ_PATH, select.POLLPRI)
+            assert woke.wait(1)
+            samples.append(wake_times[-1] - start)
+    finally:
+        stop = True
+        thread.join()
+        f.close()
+
+    results['poll wakeup'] = summarize(samples)
+
+
+def test_control_get(sysfs, results, repeat):
+    def get():
+        # sysfs.tree is served from the client's cache
+        sysfs.get_subtree('/')
+
+    results['control GET'] = summarize(
+        measure(get, repeat=max(repeat // 10, 1)))
+
+
+def test_control_set(sysfs, results, repeat, tree):
+    def set_tree():
+        sysfs.tree = tree
+
+    results['control SET'] = summarize(
+        measure(set_tree, repeat=max(repeat // 10, 1)))
+
+
+def test_control_notify(sysfs, results, repeat):
+    results['control NOTIFY'] = summarize(
+        measure(sysfs.notify, READ_PATH, 0, repeat=repeat))
+
+
+@pytest.mark.parametrize('threads', [1, 4, 16])
+def test_control_threads(sysfs, results, repeat, threads):
+    # throughput of one client shared by several threads, each reading a file
+    samples = []
+
+    def worker():
+        samples.extend(measure(sysfs.__getitem__, READ_PATH,
+                               repeat=max(repeat // threads, 1)))
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - start
+
+    result = summarize(samples)
+    result['ops_per_s'] = len(samples) / elapsed
+    results['control READ, {} threads'.format(threads)] = result
+
+
+def test_control_sync_tree(sysfs, results, repeat):
+    # keeping a copy of the tree up to date while one file changes each time
+    sysfs.sync_tree()
+    values = iter(range(repeat))
+
+    def sync():
+        sysfs[READ_PATH] = b'%d\n' % next(values)
+        sysfs.sync_tree()
+
+    results['control PUT + sync_tree'] = summarize(
+        measure(sync, repeat=repeat))
+
+
+def test_control_snapshot_restore(sysfs, results, repeat):
+    # resetting the tree between tests after one file was changed
+    sysfs.snapshot('bench')
+    values = iter(range(repeat))
+
+    def restore():
+        sysfs[READ_PATH] = b'%d\n' % next(values)
+        sysfs.restore('bench')
+
+    results['control PUT + restore'] = summarize(
+        measure(restore, repeat=repeat))
+    sysfs.drop_snapshot('bench')
+
+
+@pytest.mark.parametrize('method', ['tree', 'set_base'])
+def test_control_reset_tree(sysfs, results, repeat, tree, method):
+    # putting the tree back at the start of each test after one file was
+    # changed, by sending it again or by dropping the overlay
+    values = iter(range(repeat))
+
+    def reset():
+        sysfs[READ_PATH] = b'%d\n' % next(values)
+        if method == 'tree':
+            sysfs.tree = tree
+        else:
+            sysfs.set_base(tree)
+
+    results['control PUT + {}'.format(method)] = summarize(
+        measure(reset, repeat=repeat))
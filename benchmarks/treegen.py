@@ -0,0 +1,147 @@
+"""Generate ev3dev-shaped trees of any size for benchmarks."""
+
+import os
+import random
+
+from typing import Iterator, List, Tuple
+
+from ev3dev.testfs import encode_bytes, decode_bytes
+
+# (class name, device name prefix, typical attributes)
+DEVICE_CLASSES = [
+    ('lego-sensor', 'sensor', [
+        'address', 'command', 'commands', 'decimals', 'driver_name', 'mode',
+        'modes', 'num_values', 'poll_ms', 'units', 'value0', 'value1',
+        'value2', 'value3', 'value4', 'value5', 'value6', 'value7',
+    ]),
+    ('tacho-motor', 'motor', [
+        'address', 'command', 'commands', 'count_per_rot', 'driver_name',
+        'duty_cycle', 'duty_cycle_sp', 'max_speed', 'polarity', 'position',
+        'position_sp', 'ramp_down_sp', 'ramp_up_sp', 'speed', 'speed_sp',
+        'state', 'stop_action', 'stop_actions', 'time_sp',
+    ]),
+    ('leds', 'led', [
+        'brightness', 'max_brightness', 'trigger',
+    ]),
+]
+
+# attributes that the kernel lets user space write
+WRITABLE = {
+    'command', 'mode', 'poll_ms', 'duty_cycle_sp', 'polarity',
+    'position_sp', 'ramp_down_sp', 'ramp_up_sp', 'speed_sp', 'stop_action',
+    'time_sp', 'brightness', 'trigger',
+}
+
+
+def _dir(name: str, contents: list) -> dict:
+    return {
+        'name': name,
+        'type': 'directory',
+        'mode': 0o755,
+        'contents': contents,
+    }
+
+
+def _file(name: str, value: bytes) -> dict:
+    return {
+        'name': name,
+        'type': 'file',
+        'mode': 0o664 if name in WRITABLE else 0o444,
+        'contents': encode_bytes(value),
+    }
+
+
+def make_tree(devices: int = 8, attributes: int = 16, value_size: int = 8,
+              depth: int = 3, seed: int = 0) -> dict:
+    """Make a tree that looks like /sys on an EV3.
+
+    Devices are spread evenly over the device classes. Each device is a
+    directory under ``/devices`` that is ``depth`` directories deep, with a
+    link to it in ``/class/<class-name>``.
+
+    Parameters
+    ----------
+    devices
+        The total number of devices.
+    attributes
+        The number of attributes (files) per device. Real attribute names
+        are used first, then ``attrN``.
+    value_size
+        The size in bytes of each attribute value, including the newline.
+    depth
+        The number of directories between ``/devices`` and each device.
+    seed
+        Seed for the random attribute values.
+    """
+    rng = random.Random(seed)
+    classes = {name: [] for name, _, _ in DEVICE_CLASSES}
+    ports = []
+
+    for n in range(devices):
+        class_name, prefix, names = DEVICE_CLASSES[n % len(DEVICE_CLASSES)]
+        index = n // len(DEVICE_CLASSES)
+        device_name = '{}{}'.format(prefix, index)
+        names = names[:attributes] + [
+            'attr{}'.format(i) for i in range(attributes - len(names))]
+
+        files = []
+        for name in names:
+            value = bytes(rng.choice(b'0123456789')
+                          for _ in range(max(value_size - 1, 0)))
+            files.append(_file(name, value + b'\n'))
+
+        device = _dir(device_name, files)
+        path = ['port{}'.format(n)] + ['level{}'.format(d)
+                                       for d in range(1, depth)]
+        for name in reversed(path[1:]):
+            device = _dir(name, [device])
+        ports.append(_dir(path[0], [device]))
+
+        target = '../../devices/{}/{}'.format('/'.join(path), device_name)
+        classes[class_name].append({
+            'name': device_name,
+            'type': 'link',
+            'mode': 0o777,
+            'target': target,
+        })
+
+    return _dir('/', [
+        _dir('class', [_dir(k, v) for k, v in classes.items()]),
+        _dir('devices', ports),
+    ])
+
+
+def walk(tree: dict, path: str = '') -> Iterator[Tuple[str, dict]]:
+    """Walk a tree, yielding the absolute path and node of everything in it
+    except the root."""
+    for node in tree.get('contents', []):
+        node_path = '{}/{}'.format(path, node['name'])
+        yield node_path, node
+        if node['type'] == 'directory':
+            yield from walk(node, node_path)
+
+
+def attribute_paths(tree: dict) -> List[str]:
+    """Gets the paths of all files in a tree."""
+    return [p for p, node in walk(tree) if node['type'] == 'file']
+
+
+def directory_paths(tree: dict) -> List[str]:
+    """Gets the paths of all directories in a tree, including the root."""
+    return ['/'] + [p for p, node in walk(tree) if node['type'] == 'directory']
+
+
+def materialize(tree: dict, directory: str):
+    """Create the files, directories and links of a tree in a real directory,
+    e.g. on tmpfs to compare with the FUSE filesystem."""
+    for path, node in walk(tree):
+        full_path = directory + path
+        if node['type'] == 'directory':
+            os.mkdir(full_path)
+        elif node['type'] == 'file':
+            with open(full_path, 'wb') as f:
+                f.write(decode_bytes(node['contents']))
+        elif node['type'] == 'link':
+            os.symlink(node['target'], full_path)
+            continue
+        os.chmod(full_path, node['mode'])
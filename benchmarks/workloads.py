@@ -0,0 +1,61 @@
+"""File system workloads that can run on any directory with a tree from
+:func:`treegen.make_tree` in it.
+
+Each workload takes the directory and a repeat count and returns the
+duration of each repetition in seconds.
+"""
+
+import os
+
+from typing import List
+
+from common import measure
+
+# a readable and a writable attribute of the first motor
+READ_PATH = '/devices/port1/level1/level2/motor0/position'
+WRITE_PATH = '/devices/port1/level1/level2/motor0/speed_sp'
+DIR_PATH = '/devices/port1/level1/level2/motor0'
+
+
+def stat(root: str, repeat: int) -> List[float]:
+    return measure(os.stat, root + READ_PATH, repeat=repeat)
+
+
+def open_read_close(root: str, repeat: int) -> List[float]:
+    path = root + READ_PATH
+
+    def func():
+        fd = os.open(path, os.O_RDONLY)
+        os.read(fd, 4096)
+        os.close(fd)
+
+    return measure(func, repeat=repeat)
+
+
+def read(root: str, repeat: int) -> List[float]:
+    fd = os.open(root + READ_PATH, os.O_RDONLY)
+    try:
+        return measure(os.pread, fd, 4096, 0, repeat=repeat)
+    finally:
+        os.close(fd)
+
+
+def write(root: str, repeat: int) -> List[float]:
+    fd = os.open(root + WRITE_PATH, os.O_WRONLY)
+    try:
+        return measure(os.pwrite, fd, b'100\n', 0, repeat=repeat)
+    finally:
+        os.close(fd)
+
+
+def readdir(root: str, repeat: int) -> List[float]:
+    return measure(os.listdir, root + DIR_PATH, repeat=repeat)
+
+
+WORKLOADS = {
+    'stat': stat,
+    'open/read/close': open_read_close,
+    'read': read,
+    'write': write,
+    'readdir': readdir,
+}
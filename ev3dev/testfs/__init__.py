@@ -1,8 +1,17 @@
 import base64
+import copy
+import hashlib
+import itertools
+import json
+import os
+import re
 import sys
+import threading
+import time
 
 from select import poll, POLLIN
 from subprocess import Popen, PIPE
+from typing import Dict, Iterable
 
 from ._util import encode_dict, decode_dict, wait_for_mount
 
@@ -10,6 +19,9 @@ from ._version import get_versions
 __version__ = get_versions()['version']
 del get_versions
 
+# re.Pattern is not available before Python 3.7
+_PATTERN_TYPE = type(re.compile(''))
+
 
 def encode_bytes(b: bytes) -> str:
     """Encode a bytes-like object into a base64 unicode string object."""
@@ -21,6 +33,52 @@ def decode_bytes(s: str) -> bytes:
     return base64.b64decode(s.encode())
 
 
+def _find(tree: dict, names: list) -> dict:
+    for name in names:
+        tree = next(x for x in tree['contents'] if x['name'] == name)
+    return tree
+
+
+def _apply_changes(tree: dict, changes: list) -> dict:
+    # Applies the changes from a CHANGES reply to a tree in place and returns
+    # the root, which is different when the root itself was replaced.
+    for change in changes:
+        kind, path = change[0], change[1]
+        names = [n for n in path.split('/') if n]
+        if names:
+            contents = _find(tree, names[:-1])['contents']
+            index = next((i for i, x in enumerate(contents)
+                          if x['name'] == names[-1]), None)
+            old = None if index is None else contents[index]
+        else:
+            old = tree
+
+        if kind == 'delete':
+            if index is not None:
+                del contents[index]
+            continue
+        node = change[2]
+        if kind == 'attrs' and 'contents' in old:
+            # the attributes of a directory, its contents are unchanged
+            node = dict(node, contents=old['contents'])
+        if not names:
+            tree = node
+        elif index is None:
+            contents.append(node)
+        else:
+            contents[index] = node
+
+    # Directories are put in the same order as on the server when all nodes
+    # are there. Nodes that were removed and added again are at the end.
+    for change in changes:
+        if change[0] == 'attrs':
+            node = _find(tree, [n for n in change[1].split('/') if n])
+            if 'contents' in node:
+                order = {name: i for i, name in enumerate(change[3])}
+                node['contents'].sort(key=lambda x: order[x['name']])
+    return tree
+
+
 class Sysfs():
     """Class to manage a fake sysfs file system."""
     def __init__(self, mount_point: str):
@@ -48,11 +106,31 @@ class Sysfs():
             self._mount_point,
             # '-d',
             '-f',
-            '-o', 'auto_unmount'
+            # Like sysfs, the kernel must not cache attributes or names, so
+            # that changes like hotplug are seen by the next stat or lookup.
+            '-o', 'auto_unmount,attr_timeout=0,entry_timeout=0'
         ]
         self._p = Popen(args, stdin=PIPE, stdout=PIPE, universal_newlines=True)
         self._poll = poll()
         self._poll.register(self._p.stdout.fileno(), POLLIN)
+        # replies can arrive several at a time, so stdout is read with
+        # os.read() and split into lines here
+        self._buffer = b''
+        # Any number of threads can have a command in progress. Each command
+        # is tagged with an id that the server puts in front of the reply.
+        # One thread at a time reads replies and hands them to the others.
+        self._ids = itertools.count()
+        self._write_lock = threading.Lock()
+        self._cond = threading.Condition()
+        self._reading = False
+        self._replies = {}
+        self._abandoned = set()
+        # the generation of the last tree received and the tree, which is
+        # kept up to date with the changes since then
+        self._tree_lock = threading.Lock()
+        self._tree_cache = (-1, None)
+        # a copy of the last base tree and the digest of its encoded form
+        self._base_cache = (None, None)
 
     def __enter__(self):
         if self._read() != 'READY':
@@ -64,34 +142,261 @@ class Sysfs():
         self._p.terminate()
         self._p.wait()
 
-    def _read(self) -> str:
-        for fd, event in self._poll.poll(500):
-            return self._p.stdout.readline().strip()
-        else:
-            raise TimeoutError()
+    def _read(self, timeout: float = 0.5) -> str:
+        # reads one line from the server
+        deadline = time.monotonic() + timeout
+        while b'\n' not in self._buffer:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not self._poll.poll(remaining * 1000):
+                raise TimeoutError()
+            data = os.read(self._p.stdout.fileno(), 65536)
+            if not data:
+                raise EOFError('remote process exited')
+            self._buffer += data
+        line, _, self._buffer = self._buffer.partition(b'\n')
+        return line.decode().strip()
 
     def _write(self, msg: str):
         # using the built-in print function takes care of adding a newline
         # and helps prevent deadlocks
-        print(msg, file=self._p.stdin, flush=True)
+        with self._write_lock:
+            print(msg, file=self._p.stdin, flush=True)
+
+    def _reply(self, tag: str, timeout: float) -> str:
+        # waits for the reply to the command with the given tag
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            try:
+                while tag not in self._replies:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise TimeoutError()
+                    if self._reading:
+                        self._cond.wait(remaining)
+                        continue
+                    self._reading = True
+                    self._cond.release()
+                    try:
+                        line = self._read(remaining)
+                    finally:
+                        self._cond.acquire()
+                        self._reading = False
+                        self._cond.notify_all()
+                    other, _, reply = line.partition(' ')
+                    if other in self._abandoned:
+                        self._abandoned.remove(other)
+                    else:
+                        self._replies[other] = reply
+            except TimeoutError:
+                # drop the reply if it ever comes
+                self._abandoned.add(tag)
+                raise
+            return self._replies.pop(tag)
+
+    def _command(self, msg: str, timeout: float = 0.5) -> str:
+        # sends a command and returns the rest of the reply after 'OK'
+        tag = '#{}'.format(next(self._ids))
+        self._write('{} {}'.format(tag, msg))
+        status, _, payload = self._reply(tag, timeout).partition(' ')
+        if status != 'OK':
+            raise IOError(payload)
+        return payload
 
     @property
     def tree(self) -> dict:
-        """Gets and sets a dictionary describing the filesystem structure."""
-        self._write('GET')
-        reply = self._read().split()
-        if reply[0] != 'OK':
-            # TODO: get error message from reply
-            raise IOError()
-        return decode_dict(reply[1])
+        """Gets and sets a dictionary describing the filesystem structure.
+
+        Getting the tree is done with :meth:`sync_tree`, so only what
+        changed since the last time is transferred. Each get returns a new
+        copy that can be modified freely, which takes time for large trees.
+        Code that only reads the tree should use :meth:`sync_tree` instead.
+        """
+        with self._tree_lock:
+            # the tree only has JSON types, and this is faster than
+            # copy.deepcopy()
+            return json.loads(json.dumps(self._sync_tree()))
 
     @tree.setter
     def tree(self, d: dict):
-        self._write('SET {}'.format(encode_dict(d)))
-        reply = self._read()
-        if reply != 'OK':
-            # TODO: get error message from reply
-            raise IOError()
+        self._command('SET {}'.format(encode_dict(d)))
+
+    def get_subtree(self, path: str, depth: int = None) -> dict:
+        """Gets part of the tree, in the same format as :attr:`tree`.
+
+        Parameters
+        ----------
+        path
+            The absolute path to a node in the filesystem (relative to the
+            mount point). Links are followed, except for the last part of the
+            path.
+
+        depth
+            The number of levels of directories to include. Directories
+            deeper than that have no ``'contents'``. ``0`` only gets the node
+            at ``path`` itself. By default, everything below ``path`` is
+            included.
+        """
+        if depth is None:
+            return decode_dict(self._command('GET {}'.format(path)))
+        return decode_dict(self._command('GET {} {}'.format(path, depth)))
+
+    def sync_tree(self) -> dict:
+        """Bring the client's copy of the tree up to date and return it.
+
+        Only the nodes that changed since the previous call are transferred
+        and applied to the copy, so this is cheap even for large trees. The
+        whole tree is transferred on the first call or when too many
+        changes were made since the last one.
+
+        Returns
+        -------
+            The client's copy of the tree. It is updated in place by later
+            calls, so it must not be modified. Use :attr:`tree` to get a
+            copy instead.
+        """
+        with self._tree_lock:
+            return self._sync_tree()
+
+    def _sync_tree(self) -> dict:
+        # must be called with self._tree_lock held
+        generation, tree = self._tree_cache
+        payload = self._command('CHANGES {}'.format(generation))
+        if not payload:
+            return tree
+
+        generation, kind, data = payload.split()
+        data = decode_dict(data)
+        if kind == 'tree':
+            tree = data
+        else:
+            try:
+                tree = _apply_changes(tree, data['changes'])
+            except (LookupError, StopIteration, TypeError):
+                # the copy doesn't match the server, start over
+                self._tree_cache = (-1, None)
+                return self._sync_tree()
+        self._tree_cache = (int(generation), tree)
+        return tree
+
+    def set_base(self, tree: dict):
+        """Install a tree that many tests start from.
+
+        The server keeps the base tree unchanged. All changes, like setting
+        file contents, writes by the program under test and notifications,
+        go to a thin overlay on top of it, which :meth:`reset` drops.
+
+        When the server already has the same base, it is not sent again and
+        only the overlay is dropped, so calling this at the start of every
+        test is cheap even for large trees.
+
+        Parameters
+        ----------
+        tree
+            A dictionary in the same format as :attr:`tree`.
+        """
+        base, digest = self._base_cache
+        # comparing is a lot faster than encoding
+        if tree == base and self._command('BASE USE {}'.format(digest)) == '1':
+            return
+        encoded = encode_dict(tree)
+        digest = hashlib.sha1(encoded.encode()).hexdigest()
+        if self._command('BASE USE {}'.format(digest)) != '1':
+            self._command('BASE SET {}'.format(encoded))
+        self._base_cache = (copy.deepcopy(tree), digest)
+
+    def reset(self):
+        """Drop all changes made since :meth:`set_base`.
+
+        Only the nodes that were changed are touched. Replays are stopped,
+        pending notifications from generators are cancelled and callbacks
+        count reads from 0 again, like after :meth:`set_base`.
+        """
+        self._command('BASE RESET')
+
+    def snapshot(self, name: str):
+        """Save the current state of the filesystem under a name.
+
+        The snapshot shares all nodes with the tree until they are changed,
+        so taking one is cheap no matter how large the tree is. Everything
+        in the tree is saved, including file contents, data written by the
+        program under test, pending poll events and generator settings.
+
+        Parameters
+        ----------
+        name
+            The name of the snapshot, which must not contain whitespace. An
+            existing snapshot with the same name is replaced.
+        """
+        self._command('SNAPSHOT SAVE {}'.format(name))
+
+    def restore(self, name: str):
+        """Put the filesystem back in the state saved by :meth:`snapshot`.
+
+        Only the nodes that changed since the snapshot was taken are
+        touched, so this is much faster than setting :attr:`tree` when a
+        test only changes a few files. The snapshot is kept and can be
+        restored again.
+
+        Parameters
+        ----------
+        name
+            The name given to :meth:`snapshot`.
+        """
+        self._command('SNAPSHOT RESTORE {}'.format(name))
+
+    def drop_snapshot(self, name: str):
+        """Delete a snapshot taken with :meth:`snapshot` to free its memory.
+
+        Parameters
+        ----------
+        name
+            The name given to :meth:`snapshot`.
+        """
+        self._command('SNAPSHOT DROP {}'.format(name))
+
+    def __getitem__(self, path: str) -> bytes:
+        """Gets the contents of a file.
+
+        For example, ``sysfs['/class/leds/led0/brightness']``. Only this file
+        is transferred. Links in the path are followed and
+        files with a callback or generator return their current value.
+
+        Raises
+        ------
+        KeyError
+            When ``path`` is not a file.
+        """
+        try:
+            return decode_bytes(self._command('READ {}'.format(path)))
+        except TimeoutError:
+            # not an ERR reply, so it says nothing about the path
+            raise
+        except IOError as ex:
+            raise KeyError(path) from ex
+
+    def __setitem__(self, path: str, value: bytes):
+        """Sets the contents of a file. A new file is created if ``path``
+        does not exist yet."""
+        self._command('PUT {} {}'.format(path, encode_bytes(value)))
+
+    def __delitem__(self, path: str):
+        """Removes a file, link or directory.
+
+        Raises
+        ------
+        KeyError
+            When ``path`` does not exist.
+        """
+        try:
+            self._command('DELETE {}'.format(path))
+        except TimeoutError:
+            raise
+        except IOError as ex:
+            raise KeyError(path) from ex
+
+    def __contains__(self, path: str) -> bool:
+        """Checks whether anything exists at ``path``."""
+        return self._command('EXISTS {}'.format(path)) == '1'
 
     def notify(self, path: str, events: int):
         """Send poll notification to a path.
@@ -104,8 +409,571 @@ class Sysfs():
         events
             The event flags (``select.POLLIN``, etc.)
         """
-        self._write('NOTIFY {} {}'.format(path, events))
-        reply = self._read()
-        if reply != 'OK':
-            # TODO: get error message from reply
-            raise IOError()
+        self._command('NOTIFY {} {}'.format(path, events))
+
+    def get_many(self, paths: Iterable[str]) -> Dict[str, bytes]:
+        """Gets the contents of several files in one round trip.
+
+        All files are read at once, so changes made with :meth:`set_many`
+        or by write rules are either seen completely or not at all.
+
+        Parameters
+        ----------
+        paths
+            The absolute paths to the files in the filesystem (relative to
+            the mount point).
+
+        Returns
+        -------
+            A dictionary of paths to contents.
+        """
+        paths = list(paths)
+        reply = decode_dict(self._command('MGET {}'.format(' '.join(paths))))
+        return {p: decode_bytes(v) for p, v in zip(paths, reply['values'])}
+
+    def set_many(self, values: Dict[str, bytes]):
+        """Sets the contents of several files in one round trip.
+
+        The files are changed all at once, so programs reading them never
+        see some of the new values with some of the old ones. Nothing is
+        changed when any of the paths is not a file.
+
+        Parameters
+        ----------
+        values
+            A dictionary of absolute paths to files in the filesystem
+            (relative to the mount point) to their new contents.
+        """
+        values = {p: encode_bytes(v) for p, v in values.items()}
+        self._command('MSET {}'.format(encode_dict(values)))
+
+    def wait_for_write(self, path: str, match=None,
+                       timeout: float = 1.0) -> bytes:
+        """Wait until the program under test writes to a file.
+
+        The matching is done by the filesystem process as part of the write,
+        so this returns as soon as a matching write happens. Only writes
+        made after this is called count.
+
+        Parameters
+        ----------
+        path
+            The absolute path to the file in the filesystem (relative to the
+            mount point). Links are followed.
+
+        match
+            What to wait for: ``None`` for any write, a ``bytes`` or ``str``
+            value for that exact value with or without a trailing newline
+            (e.g. ``'run-forever'``) or a compiled regular expression that
+            must match all of the written data.
+
+        timeout
+            The maximum time to wait in seconds.
+
+        Returns
+        -------
+            The data that was written.
+
+        Raises
+        ------
+        TimeoutError
+            When there was no matching write in time.
+        """
+        if match is None:
+            args = ''
+        elif isinstance(match, (bytes, str)):
+            if isinstance(match, str):
+                match = match.encode()
+            pattern = re.escape(match.rstrip(b'\n')) + b'\n?'
+            args = ' {} 0'.format(encode_bytes(pattern))
+        elif isinstance(match, _PATTERN_TYPE):
+            pattern = match.pattern
+            if isinstance(pattern, str):
+                pattern = pattern.encode()
+            # bytes patterns can't have re.UNICODE
+            args = ' {} {}'.format(encode_bytes(pattern),
+                                   int(match.flags & ~re.UNICODE))
+        else:
+            raise TypeError('match must be None, bytes, str or a compiled '
+                            'regular expression')
+
+        # leave some time for the reply to arrive after the server times out
+        payload = self._command(
+            'WAIT {} {}{}'.format(path, timeout, args), timeout + 1.0)
+        if not payload:
+            raise TimeoutError('no matching write to {}'.format(path))
+        return decode_bytes(decode_dict(payload)['data'])
+
+    def replay(self, path: str, filename: str, speed: float = 1.0,
+               loop: bool = False):
+        """Replay a recorded trace into the value attributes of a sensor.
+
+        The samples are streamed by the filesystem process itself, so this
+        returns immediately. Each sample sets the contents of ``value0``,
+        ``value1``, etc. and sends a ``select.POLLPRI`` notification to each of
+        them. Starting a new replay on the same path stops the previous one.
+
+        Parameters
+        ----------
+        path
+            The absolute path to the sensor directory in the filesystem
+            (relative to the mount point).
+
+        filename
+            Path to a CSV file. Each row contains a timestamp in seconds
+            followed by one column for each value attribute. An optional
+            header row is skipped.
+
+        speed
+            Playback speed relative to the recorded timestamps.
+
+        loop
+            When ``True``, the trace is played over and over.
+        """
+        params = {
+            'path': path,
+            'filename': os.path.abspath(filename),
+            'speed': speed,
+            'loop': loop,
+        }
+        self._command('REPLAY START {}'.format(encode_dict(params)))
+
+    def stop_replay(self, path: str):
+        """Stop a replay started with :meth:`replay`.
+
+        Parameters
+        ----------
+        path
+            The same path that was given to :meth:`replay`.
+        """
+        self._command('REPLAY STOP {}'.format(path))
+
+    def set_generator(self, path: str, kind: str, rate: float,
+                      notify: bool = False, fmt: str = None, **params):
+        """Bind a file to a generator so that its value changes over time.
+
+        The value is computed by the filesystem process when the file is read,
+        so there is no cost when nobody reads it. The static contents of the
+        file are ignored while a generator is bound.
+
+        Parameters
+        ----------
+        path
+            The absolute path to a file in the filesystem (relative to the
+            mount point).
+
+        kind
+            One of ``'ramp'``, ``'sine'``, ``'square'`` or ``'noise'``.
+
+        rate
+            How many times per second the value changes.
+
+        notify
+            When ``True``, a process waiting in ``poll()`` on the file gets a
+            ``select.POLLPRI`` notification each time the value changes.
+
+        fmt
+            Format string used to convert the value to text, e.g.
+            ``'{:.2f}'``. By default, the value is rounded to an integer.
+
+        params
+            Parameters for the generator:
+
+            * ``ramp``: ``slope``, ``offset``, ``period``
+            * ``sine``: ``frequency``, ``amplitude``, ``offset``, ``phase``
+            * ``square``: ``frequency``, ``low``, ``high``, ``duty``
+            * ``noise``: ``seed``, ``mean``, ``stddev``
+        """
+        decl = {
+            'kind': kind,
+            'rate': rate,
+            'notify': notify,
+            'params': params,
+        }
+        if fmt is not None:
+            decl['format'] = fmt
+        self._command('GENERATOR SET {} {}'.format(path, encode_dict(decl)))
+
+    def clear_generator(self, path: str):
+        """Remove a generator bound with :meth:`set_generator`.
+
+        Parameters
+        ----------
+        path
+            The same path that was given to :meth:`set_generator`.
+        """
+        self._command('GENERATOR CLEAR {}'.format(path))
+
+    def register_callback(self, name: str, plugin: str = None,
+                          expression: str = None):
+        """Register a function that computes the contents of files.
+
+        The function runs in the filesystem process each time a file that uses
+        it is read at offset 0. Reads at other offsets (e.g. a large value read
+        in several chunks) reuse the result for the same open file.
+
+        Parameters
+        ----------
+        name
+            The name used to refer to the callback in :meth:`set_callback`.
+
+        plugin
+            A function given as ``'module:function'``. The module must be
+            importable by the filesystem process. The function is called with
+            the path, the tree node (a dictionary) and the time in seconds.
+
+        expression
+            A Python expression, e.g. ``'count * 10'``. It can use the names
+            ``path``, ``node``, ``time``, ``count`` (the number of times it
+            was evaluated for the file before) and ``math``.
+
+        Notes
+        -----
+        The callback can return ``bytes``, which are used as-is, or any other
+        value, which is converted with ``str()`` and followed by a newline.
+        """
+        params = {'plugin': plugin, 'expression': expression}
+        self._command('CALLBACK REGISTER {} {}'.format(name,
+                                                       encode_dict(params)))
+
+    def set_callback(self, path: str, name: str):
+        """Compute the contents of a file with a registered callback.
+
+        The static contents of the file are ignored while a callback is set.
+
+        Parameters
+        ----------
+        path
+            The absolute path to a file in the filesystem (relative to the
+            mount point).
+
+        name
+            The name given to :meth:`register_callback`.
+        """
+        self._command('CALLBACK SET {} {}'.format(path, name))
+
+    def clear_callback(self, path: str):
+        """Remove a callback set with :meth:`set_callback`.
+
+        Parameters
+        ----------
+        path
+            The same path that was given to :meth:`set_callback`.
+        """
+        self._command('CALLBACK CLEAR {}'.format(path))
+
+    def set_rules(self, rules: list):
+        """Set rules that react to files being written.
+
+        Rules are applied by the filesystem process in the same ``write()``
+        call, so the reaction is visible as soon as the write returns. Each
+        call replaces all previous rules.
+
+        Parameters
+        ----------
+        rules
+            List of dictionaries, applied in order. Each one has the keys:
+
+            * ``'path'``: Glob matching the written file. ``*`` and ``?`` do
+              not match ``/``, ``**`` does. The kernel resolves links before
+              the filesystem sees the write, so this must match the path
+              without links, e.g. ``/devices/...`` rather than a link in
+              ``/class``.
+            * ``'value'``: Optional written value (without trailing newline)
+              that triggers the rule. By default any value does.
+            * ``'set'``: Optional mapping of paths to new contents. A newline
+              is added to the contents and ``{value}`` is replaced with the
+              written value.
+            * ``'notify'``: Optional mapping of paths to poll event flags.
+
+            Paths in ``'set'`` and ``'notify'`` are relative to the directory
+            of the written file unless they are absolute.
+
+        Example
+        -------
+        ::
+
+            sysfs.set_rules([{
+                'path': '/devices/**/tacho-motor/*/command',
+                'value': 'reset',
+                'set': {'position': '0', 'state': ''},
+                'notify': {'state': select.POLLPRI},
+            }])
+        """
+        self._command('RULES {}'.format(encode_dict(rules)))
+
+    def pause_clock(self):
+        """Pause the virtual clock of the filesystem process.
+
+        The virtual clock paces everything that changes over time: trace
+        replays, generators and the ``time`` given to callbacks. It starts at
+        0 when the filesystem is mounted and runs at real time.
+        """
+        self._command('CLOCK PAUSE')
+
+    def run_clock(self, speed: float = 1.0):
+        """Run the virtual clock freely.
+
+        Parameters
+        ----------
+        speed
+            The speed relative to real time, e.g. ``10`` makes a 60 second
+            scenario take 6 seconds.
+        """
+        self._command('CLOCK RUN {!r}'.format(float(speed)))
+
+    def fast_forward_clock(self):
+        """Run the virtual clock as fast as possible.
+
+        Instead of waiting, the clock jumps straight to the next time when
+        something is scheduled to happen.
+        """
+        self._command('CLOCK FAST')
+
+    def step_clock(self, ms: int):
+        """Move the virtual clock forward.
+
+        Everything scheduled during the step happens, in order, at the time
+        it was scheduled for before this returns. With a paused clock, this
+        makes simulations reproducible.
+
+        Parameters
+        ----------
+        ms
+            The number of milliseconds to step.
+        """
+        self._command('CLOCK STEP {}'.format(int(ms)))
+
+    @property
+    def clock_time(self) -> float:
+        """Gets the time of the virtual clock in seconds."""
+        return float(self._command('CLOCK TIME'))
+
+    def add_device(self, path: str, node: dict, link: str = None):
+        """Hotplug a device.
+
+        Only the new nodes are sent to the filesystem process, so this is
+        much faster than setting :attr:`tree` and does not disturb clients
+        that are reading other files. The parent directory gets a new
+        modification time and pollers waiting on it are notified.
+
+        Parameters
+        ----------
+        path
+            The absolute path of the new device directory in the filesystem
+            (relative to the mount point). The parent directory must exist.
+
+        node
+            Dictionary describing the device directory, in the same format as
+            :attr:`tree`. The ``'name'`` is taken from ``path``.
+
+        link
+            Optional path, e.g. ``'/class/lego-sensor/sensor0'``, where a
+            symbolic link to the device is created like in ``/sys/class``.
+        """
+        params = {'path': path, 'node': node, 'link': link}
+        self._command('HOTPLUG ADD {}'.format(encode_dict(params)))
+
+    def remove_device(self, path: str, link: str = None):
+        """Unplug a device added with :meth:`add_device`.
+
+        Clients waiting in ``poll()`` on an attribute of the device are woken
+        up and get ``select.POLLERR``, like with real sysfs.
+
+        Parameters
+        ----------
+        path
+            The same path that was given to :meth:`add_device`.
+
+        link
+            The same link that was given to :meth:`add_device`.
+        """
+        params = {'path': path, 'link': link}
+        self._command('HOTPLUG REMOVE {}'.format(encode_dict(params)))
+
+    def register_template(self, name: str, node: dict):
+        """Register a template for lazily created directories.
+
+        A directory in :attr:`tree` that has a ``'lazy'`` key instead of
+        ``'contents'`` is only filled in from the template when a client
+        first looks inside it. This makes installing a large tree fast and
+        keeps memory use proportional to what clients actually use.
+
+        Parameters
+        ----------
+        name
+            The name used to refer to the template.
+
+        node
+            Dictionary describing a directory, in the same format as
+            :attr:`tree`. The string ``{param}`` in the names, file contents
+            and link targets is replaced by the value of ``param``.
+
+        Example
+        -------
+        ::
+
+            sysfs.register_template('lego-sensor', {
+                'type': 'directory',
+                'mode': 0o755,
+                'contents': [{
+                    'name': 'address',
+                    'type': 'file',
+                    'mode': 0o444,
+                    'contents': encode_bytes(b'{address}\\n'),
+                }],
+            })
+            sensor0 = {
+                'name': 'sensor0',
+                'type': 'directory',
+                'mode': 0o755,
+                'lazy': {
+                    'template': 'lego-sensor',
+                    'params': {'address': 'in1'},
+                },
+            }
+        """
+        self._command('TEMPLATE {} {}'.format(name, encode_dict(node)))
+
+    def stats(self, reset: bool = False) -> dict:
+        """Get performance counters from the filesystem process.
+
+        Parameters
+        ----------
+        reset
+            When ``True``, the counters are cleared after reading them.
+
+        Returns
+        -------
+            A dictionary with an entry for each FUSE operation (e.g.
+            ``'getattr'``, ``'read'``), each tree lookup (``'lookup'``) and
+            each control command (e.g. ``'GET'``) that ran since the last
+            reset. Each entry has ``'count'``, ``'total_us'``, ``'mean_us'``,
+            ``'max_us'``, ``'p50_us'`` and ``'p99_us'`` and a
+            ``'histogram'`` of ``[upper_bound_us, count]`` pairs with
+            power-of-two buckets. The percentiles are estimated from the
+            histogram.
+        """
+        return decode_dict(self._command('STATS RESET' if reset else 'STATS'))
+
+    def start_tracing(self, capacity: int = 65536):
+        """Start recording every operation in the filesystem process.
+
+        Each FUSE operation, tree lookup, control command and scheduled
+        simulation step (trace replay samples, generator notifications) is
+        recorded with its start and end time, thread and path. Starting again
+        discards the events recorded so far.
+
+        Parameters
+        ----------
+        capacity
+            The number of events kept. When more events happen, the oldest
+            ones are dropped.
+        """
+        self._command('TRACING START {}'.format(int(capacity)))
+
+    def get_trace(self) -> dict:
+        """Get the events recorded since :meth:`start_tracing`.
+
+        Returns
+        -------
+            A dictionary in Chrome trace format. Save it with
+            :func:`json.dump` and open the file with ``chrome://tracing`` or
+            https://ui.perfetto.dev.
+        """
+        return decode_dict(self._command('TRACING DUMP'))
+
+    def stop_tracing(self):
+        """Stop recording operations and discard the recorded events."""
+        self._command('TRACING STOP')
+
+    def start_profiling(self, interval_ms: float = 1.0):
+        """Start profiling the filesystem process.
+
+        This uses a sampling profiler that looks at the stack of every thread
+        in the filesystem process at a regular interval, so it can be used on
+        a running workload without restarting the mount. Threads that are
+        waiting for work are not counted.
+
+        Parameters
+        ----------
+        interval_ms
+            The time between samples in milliseconds.
+        """
+        self._command('PROFILE START {!r}'.format(float(interval_ms)))
+
+    def stop_profiling(self) -> dict:
+        """Stop profiling started with :meth:`start_profiling`.
+
+        Returns
+        -------
+            A dictionary with:
+
+            * ``'interval_ms'``: the time between samples.
+            * ``'samples'``: the number of times the threads were sampled.
+            * ``'functions'``: a list of dictionaries with the
+              ``'function'`` (``'file:line(name)'``) and the number of
+              samples where it was running (``'self'``) or anywhere on the
+              stack (``'total'``), sorted by ``'self'``.
+            * ``'stacks'``: a mapping of stacks in collapsed format
+              (``'thread;outer;...;inner'``) to sample counts, e.g. for
+              making a flame graph.
+        """
+        return decode_dict(self._command('PROFILE STOP'))
+
+    def start_recording(self):
+        """Start recording the operations that clients make on the filesystem.
+
+        The recording includes the tree at the time this is called, so it can
+        be replayed on a fresh mount with ``benchmarks/replay.py``.
+        """
+        self._command('RECORD START')
+
+    def stop_recording(self, filename: str):
+        """Stop a recording started with :meth:`start_recording`.
+
+        Parameters
+        ----------
+        filename
+            The file where the recording is saved. It contains one JSON
+            array per operation with the time since the previous operation,
+            the operation, the path and its size and offset arguments.
+        """
+        recording = decode_bytes(self._command('RECORD STOP'))
+        with open(filename, 'wb') as f:
+            f.write(recording)
+
+    def memory_usage(self) -> dict:
+        """Get the memory usage of the filesystem process.
+
+        Returns
+        -------
+            A dictionary with:
+
+            * ``'vmrss_bytes'``, ``'vmhwm_bytes'``: the resident set size and
+              its peak.
+            * ``'structures'``: the sizes of internal structures that could
+              grow while the filesystem is in use, e.g. ``'poll_handles'``
+              and ``'write_data_bytes'``.
+            * ``'tracemalloc'``: only when :meth:`trace_allocations` is on,
+              the ``'current_bytes'`` and ``'peak_bytes'`` allocated by Python
+              and the ``'top'`` 20 allocation sites as
+              ``[traceback, size, count]``.
+        """
+        return decode_dict(self._command('MEMORY'))
+
+    def trace_allocations(self, enable: bool = True, frames: int = 1):
+        """Turn :mod:`tracemalloc` on or off in the filesystem process.
+
+        Parameters
+        ----------
+        enable
+            ``True`` to start tracing, ``False`` to stop.
+
+        frames
+            The number of frames stored for each allocation.
+        """
+        if enable:
+            self._command('MEMORY START {}'.format(int(frames)))
+        else:
+            self._command('MEMORY STOP')
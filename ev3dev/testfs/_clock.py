@@ -0,0 +1,117 @@
+import threading
+import time
+
+from typing import Callable, Optional
+
+
+class Clock():
+    """Virtual time used for everything the server simulates.
+
+    The clock starts at 0 and runs at real time. It can be paused, stepped,
+    run at a different speed or put in fast-forward mode, where the
+    :class:`~ev3dev.testfs._sched.Scheduler` jumps straight to the next
+    scheduled event instead of waiting for it.
+    """
+    def __init__(self, timefunc: Callable[[], float] = time.monotonic,
+                 speed: float = 1.0):
+        """
+        Parameters
+        ----------
+        timefunc
+            Function that returns the real time in seconds.
+        speed
+            The initial speed relative to real time. Use ``0`` to start
+            paused.
+        """
+        self._real = timefunc
+        self._lock = threading.Lock()
+        self._speed = speed
+        self._fast = False
+        self._base_virtual = 0.0
+        self._base_real = timefunc()
+
+    def _time(self) -> float:
+        return (self._base_virtual +
+                (self._real() - self._base_real) * self._speed)
+
+    def _rebase(self, speed: float):
+        now = self._real()
+        self._base_virtual += (now - self._base_real) * self._speed
+        self._base_real = now
+        self._speed = speed
+
+    def time(self) -> float:
+        """Gets the virtual time in seconds."""
+        with self._lock:
+            return self._time()
+
+    __call__ = time
+
+    @property
+    def paused(self) -> bool:
+        """Gets ``True`` when time only moves by calling :meth:`advance`."""
+        with self._lock:
+            return self._speed == 0 and not self._fast
+
+    @property
+    def fast_forward(self) -> bool:
+        """Gets ``True`` when in fast-forward mode."""
+        with self._lock:
+            return self._fast
+
+    @property
+    def speed(self) -> float:
+        """Gets the speed relative to real time (0 when not running)."""
+        with self._lock:
+            return self._speed
+
+    def pause(self):
+        """Stops the clock."""
+        with self._lock:
+            self._rebase(0.0)
+            self._fast = False
+
+    def run(self, speed: float = 1.0):
+        """Runs the clock at ``speed`` times real time."""
+        if speed <= 0:
+            raise ValueError('speed must be greater than 0')
+        with self._lock:
+            self._rebase(speed)
+            self._fast = False
+
+    def start_fast_forward(self):
+        """Stops the clock and lets the scheduler move it from event to
+        event as fast as possible."""
+        with self._lock:
+            self._rebase(0.0)
+            self._fast = True
+
+    def advance(self, seconds: float):
+        """Moves the clock forward, independent of the mode."""
+        if seconds < 0:
+            raise ValueError('time cannot go backwards')
+        with self._lock:
+            self._rebase(self._speed)
+            self._base_virtual += seconds
+
+    def advance_to(self, when: float):
+        """Moves the clock forward to ``when`` if it is in the future."""
+        with self._lock:
+            self._rebase(self._speed)
+            if when > self._base_virtual:
+                self._base_virtual = when
+
+    def real_delay(self, when: float) -> Optional[float]:
+        """Gets the number of real seconds until the clock reaches ``when``.
+
+        Returns
+        -------
+            The delay, ``0`` in fast-forward mode or ``None`` if the clock is
+            paused.
+        """
+        with self._lock:
+            if self._fast:
+                return 0.0
+            if self._speed == 0:
+                return None
+            return (when - self._time()) / self._speed
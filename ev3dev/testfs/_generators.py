@@ -0,0 +1,88 @@
+import math
+import random
+
+from typing import Optional
+
+
+def ramp(t: float, n: int, slope: float = 1.0, offset: float = 0.0,
+         period: Optional[float] = None) -> float:
+    """Linear ramp, optionally repeating every ``period`` seconds."""
+    if period:
+        t %= period
+    return offset + slope * t
+
+
+def sine(t: float, n: int, frequency: float = 1.0, amplitude: float = 1.0,
+         offset: float = 0.0, phase: float = 0.0) -> float:
+    """Sine wave. ``phase`` is in degrees."""
+    return offset + amplitude * math.sin(2 * math.pi * frequency * t +
+                                         math.radians(phase))
+
+
+def square(t: float, n: int, frequency: float = 1.0, low: float = 0.0,
+           high: float = 1.0, duty: float = 0.5) -> float:
+    """Square wave. ``duty`` is the fraction of the period spent ``high``."""
+    return high if (t * frequency) % 1.0 < duty else low
+
+
+def noise(t: float, n: int, seed: int = 0, mean: float = 0.0,
+          stddev: float = 1.0) -> float:
+    """Gaussian noise. The same seed always gives the same sequence."""
+    return random.Random('{}:{}'.format(seed, n)).gauss(mean, stddev)
+
+
+KINDS = {
+    'ramp': ramp,
+    'sine': sine,
+    'square': square,
+    'noise': noise,
+}
+
+
+class Generator():
+    """A value that changes over time at a fixed rate."""
+    def __init__(self, kind: str, rate: float, start: float,
+                 fmt: Optional[str] = None, **params):
+        """
+        Parameters
+        ----------
+        kind
+            One of the keys of :data:`KINDS`.
+        rate
+            How many times per second the value changes.
+        start
+            The time at which the generator starts, in seconds.
+        fmt
+            Format string used to convert the value to text. By default the
+            value is rounded to an integer like most sysfs attributes.
+        params
+            Keyword arguments for the function selected by ``kind``.
+        """
+        if kind not in KINDS:
+            raise ValueError('Unknown generator: {}'.format(kind))
+        if rate <= 0:
+            raise ValueError('rate must be greater than 0')
+        self._func = KINDS[kind]
+        self._rate = rate
+        self._start = start
+        self._fmt = fmt
+        self._params = params
+        # catch bad parameters now instead of on the first read
+        self._func(0.0, 0, **params)
+
+    def _tick(self, now: float) -> int:
+        return math.floor((now - self._start) * self._rate)
+
+    def value(self, now: float) -> bytes:
+        """Gets the formatted value at the given time."""
+        n = self._tick(now)
+        v = self._func(n / self._rate, n, **self._params)
+        if self._fmt is None:
+            text = str(int(round(v)))
+        else:
+            text = self._fmt.format(v)
+        return text.encode() + b'\n'
+
+    def next_change(self, now: float) -> float:
+        """Gets the time at which the value will change next."""
+        return self._start + (self._tick(now) + 1) / self._rate
@@ -0,0 +1,81 @@
+import itertools
+import os
+import threading
+import time
+
+
+class Tracer():
+    """Records timed events in a ring buffer.
+
+    The buffer is allocated up front and recording an event does not take a
+    lock, so tracing can stay on while measuring a workload. When the buffer
+    is full, the oldest events are overwritten.
+    """
+    def __init__(self, capacity: int = 65536):
+        """
+        Parameters
+        ----------
+        capacity
+            The maximum number of events that are kept.
+        """
+        if capacity <= 0:
+            raise ValueError('capacity must be greater than 0')
+        self._capacity = capacity
+        self._events = [None] * capacity
+        # next() on itertools.count is atomic, so threads never get the same
+        # slot
+        self._counter = itertools.count()
+        self._origin = time.perf_counter()
+
+    def add(self, name: str, category: str, path: str, start: float,
+            end: float):
+        """Records an event.
+
+        Parameters
+        ----------
+        name
+            The name of the operation.
+        category
+            The kind of operation, e.g. ``'fuse'``.
+        path
+            The path the operation applies to or ``''``.
+        start
+            The start time from :func:`time.perf_counter`.
+        end
+            The end time from :func:`time.perf_counter`.
+        """
+        n = next(self._counter)
+        self._events[n % self._capacity] = (
+            name, category, path, start, end, threading.get_ident())
+
+    def to_chrome(self) -> dict:
+        """Gets the events in Chrome trace format.
+
+        The result can be saved as JSON and opened with ``chrome://tracing``
+        or https://ui.perfetto.dev.
+        """
+        pid = os.getpid()
+        events = [e for e in self._events if e is not None]
+        events.sort(key=lambda e: e[3])
+        trace = [{
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'ts': (start - self._origin) * 1e6,
+            'dur': (end - start) * 1e6,
+            'pid': pid,
+            'tid': tid,
+            'args': {'path': path} if path else {},
+        } for name, category, path, start, end, tid in events]
+
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for tid in sorted({e[5] for e in events}):
+            trace.append({
+                'name': 'thread_name',
+                'ph': 'M',
+                'pid': pid,
+                'tid': tid,
+                'args': {'name': names.get(tid, 'fuse-{}'.format(tid))},
+            })
+
+        return {'traceEvents': trace, 'displayTimeUnit': 'ms'}
@@ -0,0 +1,96 @@
+import collections
+import os
+import sys
+import threading
+
+from types import CodeType
+from typing import Iterable
+
+
+def _label(code: CodeType) -> str:
+    # same format as pstats
+    return '{}:{}({})'.format(os.path.basename(code.co_filename),
+                              code.co_firstlineno, code.co_name)
+
+
+class SamplingProfiler():
+    """Profiles all threads of the process by sampling their stacks.
+
+    Unlike :mod:`cProfile`, this sees every thread, including the ones
+    created by libfuse, and can be started and stopped at any time. The cost
+    is one walk of each thread's stack per interval, independent of what the
+    threads are doing.
+    """
+    def __init__(self, interval: float = 0.001,
+                 idle: Iterable[CodeType] = ()):
+        """
+        Parameters
+        ----------
+        interval
+            The time between samples in seconds.
+        idle
+            Code objects where threads wait for work. Samples of threads that
+            are in one of these functions are not counted.
+        """
+        if interval <= 0:
+            raise ValueError('interval must be greater than 0')
+        self._interval = interval
+        self._idle = frozenset(idle)
+        self._stacks = collections.Counter()
+        self._samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        """Starts taking samples."""
+        self._thread.start()
+
+    def stop(self) -> dict:
+        """Stops taking samples.
+
+        Returns
+        -------
+            A dictionary with the ``'interval_ms'``, the number of
+            ``'samples'`` taken, ``'functions'``, a list of dictionaries with
+            the ``'function'`` and the number of samples where it was running
+            (``'self'``) or on the stack (``'total'``), sorted by ``'self'``,
+            and ``'stacks'``, a mapping of stacks in collapsed format
+            (``'thread;outer;...;inner'``) to sample counts, which can be fed
+            to flame graph tools.
+        """
+        self._stop.set()
+        self._thread.join()
+
+        own = collections.Counter()
+        total = collections.Counter()
+        for stack, count in self._stacks.items():
+            functions = stack.split(';')[1:]
+            own[functions[-1]] += count
+            for f in set(functions):
+                total[f] += count
+
+        functions = [{'function': f, 'self': own[f], 'total': total[f]}
+                     for f in total]
+        functions.sort(key=lambda x: (-x['self'], -x['total']))
+
+        return {
+            'interval_ms': self._interval * 1000,
+            'samples': self._samples,
+            'functions': functions,
+            'stacks': dict(self._stacks),
+        }
+
+    def _run(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self._interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            self._samples += 1
+            for tid, frame in sys._current_frames().items():
+                if tid == me or frame.f_code in self._idle:
+                    continue
+                stack = []
+                while frame:
+                    stack.append(_label(frame.f_code))
+                    frame = frame.f_back
+                stack.append(names.get(tid, 'fuse-{}'.format(tid)))
+                self._stacks[';'.join(reversed(stack))] += 1
@@ -0,0 +1,114 @@
+"""Recording of the FUSE operations made by a client.
+
+A recording is a text file. The first line identifies the format, the second
+has the tree at the start of the recording and each of the other lines is
+one operation, as a JSON array so that paths can contain any character::
+
+    # ev3dev-testfs access log 2
+    tree <encoded tree>
+    [<microseconds since previous operation>, <operation>, <path>, args...]
+
+The arguments depend on the operation:
+
+* ``open``, ``release``: flags
+* ``read``: size offset
+* ``write``: offset data (base64)
+* ``truncate``: size
+"""
+
+import json
+import threading
+import time
+
+from typing import Iterator, Tuple
+
+from ..testfs import encode_bytes, decode_bytes
+
+HEADER = '# ev3dev-testfs access log 2'
+
+Record = Tuple[float, str, str, tuple]
+
+
+def _encode_args(op: str, args: tuple) -> list:
+    if op in ('open', 'release', 'truncate'):
+        return [args[0]]
+    if op == 'read':
+        return [args[0], args[1]]
+    if op == 'write':
+        return [args[1], encode_bytes(args[0])]
+    return []
+
+
+def _decode_args(op: str, args: list) -> tuple:
+    if op in ('open', 'release', 'truncate'):
+        return (int(args[0]),)
+    if op == 'read':
+        return (int(args[0]), int(args[1]))
+    if op == 'write':
+        return (decode_bytes(args[1]), int(args[0]))
+    return ()
+
+
+class Recorder():
+    """Records FUSE operations in memory."""
+    def __init__(self, tree: str):
+        """
+        Parameters
+        ----------
+        tree
+            The encoded tree at the start of the recording.
+        """
+        self._tree = tree
+        self._last = time.perf_counter()
+        self._lines = []
+        # FUSE operations are recorded from several threads
+        self._lock = threading.Lock()
+
+    def add(self, op: str, path: str, args: tuple, start: float):
+        """Records an operation.
+
+        Parameters
+        ----------
+        op
+            The name of the FUSE operation.
+        path
+            The path the operation applies to.
+        args
+            The rest of the arguments of the FUSE operation.
+        start
+            The time from :func:`time.perf_counter` when the operation
+            started.
+        """
+        fields = [op, path] + _encode_args(op, args)
+        with self._lock:
+            delay = max(int((start - self._last) * 1e6), 0)
+            self._last = start
+            self._lines.append(json.dumps([delay] + fields))
+
+    def dumps(self) -> str:
+        """Gets the recording in the file format described above."""
+        with self._lock:
+            lines = list(self._lines)
+        return '\n'.join([HEADER, 'tree ' + self._tree] + lines) + '\n'
+
+
+def loads(text: str) -> Tuple[str, Iterator[Record]]:
+    """Parses a recording.
+
+    Returns
+    -------
+        The encoded tree and an iterator of operations, each a tuple of the
+        delay in seconds since the previous operation, the name of the
+        operation, the path and the rest of the arguments.
+    """
+    lines = text.splitlines()
+    if not lines or lines[0] != HEADER:
+        raise ValueError('Not an access log')
+    tree = lines[1].split()[1]
+
+    def records():
+        for line in lines[2:]:
+            delay, op, path, *args = json.loads(line)
+            yield delay / 1e6, op, path, _decode_args(op, args)
+
+    return tree, records()
@@ -0,0 +1,119 @@
+import posixpath
+import re
+
+from typing import Dict, Iterator, List, Tuple
+
+Actions = Tuple[Dict[str, str], Dict[str, int]]
+
+
+def glob_to_regex(pattern: str) -> str:
+    """Convert a path glob to a regular expression.
+
+    ``*`` and ``?`` do not match ``/``. ``**`` matches anything, including
+    ``/``.
+    """
+    parts = []
+    for token in re.split(r'(\*\*|\*|\?)', pattern):
+        if token == '**':
+            parts.append('.*')
+        elif token == '*':
+            parts.append('[^/]*')
+        elif token == '?':
+            parts.append('[^/]')
+        else:
+            parts.append(re.escape(token))
+    return '(?s:{})\\Z'.format(''.join(parts))
+
+
+class Rule():
+    """A reaction to writing a file."""
+    def __init__(self, path: str, value: str = None, set: dict = None,
+                 notify: dict = None):
+        """
+        Parameters
+        ----------
+        path
+            Glob matching the path of the written file, which never
+            contains links.
+        value
+            The written value (without a trailing newline) that triggers the
+            rule or ``None`` to match any value.
+        set
+            Mapping of paths to new contents. Paths are relative to the
+            directory of the written file unless they are absolute. The
+            string ``{value}`` in the contents is replaced with the written
+            value.
+        notify
+            Mapping of paths to poll event flags.
+        """
+        self.path = path
+        self.value = value
+        self.set = set or {}
+        self.notify = notify or {}
+        self._regex = re.compile(glob_to_regex(path))
+
+    def match_path(self, path: str) -> bool:
+        """Tests if the rule applies to a path."""
+        return bool(self._regex.match(path))
+
+
+class RuleTable():
+    """Compiled list of rules."""
+    def __init__(self, rules: List[dict]):
+        """
+        Parameters
+        ----------
+        rules
+            Keyword arguments for :class:`Rule`, in the order the rules are
+            applied.
+        """
+        self._rules = [Rule(**r) for r in rules]
+        # the same few files get written over and over, so remember which
+        # rules apply to each path
+        self._cache = {}
+
+    @property
+    def cache_size(self) -> int:
+        """Gets the number of paths with cached matching rules."""
+        return len(self._cache)
+
+    def _rules_for(self, path: str) -> List[Rule]:
+        rules = self._cache.get(path)
+        if rules is None:
+            rules = [r for r in self._rules if r.match_path(path)]
+            self._cache[path] = rules
+        return rules
+
+    def match(self, path: str, data: bytes) -> Iterator[Actions]:
+        """Finds the rules triggered by a write.
+
+        Parameters
+        ----------
+        path
+            The path of the written file.
+        data
+            The written data.
+
+        Yields
+        ------
+            For each rule, a mapping of absolute paths to new contents and a
+            mapping of absolute paths to poll events.
+        """
+        rules = self._rules_for(path)
+        if not rules:
+            return
+        value = data.decode(errors='replace').rstrip('\n')
+        directory = posixpath.dirname(path)
+        for rule in rules:
+            if rule.value is not None and rule.value != value:
+                continue
+            updates = {
+                posixpath.normpath(posixpath.join(directory, p)):
+                    c.replace('{value}', value)
+                for p, c in rule.set.items()
+            }
+            events = {
+                posixpath.normpath(posixpath.join(directory, p)): e
+                for p, e in rule.notify.items()
+            }
+            yield updates, events
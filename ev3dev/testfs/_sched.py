@@ -0,0 +1,151 @@
+import heapq
+import itertools
+import threading
+import time
+import traceback
+
+from typing import Callable
+
+from ._clock import Clock
+
+
+class Scheduler():
+    """Runs callbacks at given times on a background thread.
+
+    This is used by the server for everything that happens on its own, i.e.
+    not as a direct response to a FUSE operation or a control command. Times
+    are read from a :class:`~ev3dev.testfs._clock.Clock`, so the pace of
+    everything scheduled follows the virtual clock.
+    """
+    def __init__(self, clock: Clock = None):
+        """
+        Parameters
+        ----------
+        clock
+            The time source. A new clock running at real time is used by
+            default.
+        """
+        self.clock = clock or Clock()
+        # optional ev3dev.testfs._optrace.Tracer for recording callbacks
+        self.tracer = None
+        self._queue = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        # callbacks never run concurrently, no matter which thread runs them
+        self._run_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def time(self) -> float:
+        """Gets the current time in seconds."""
+        return self.clock.time()
+
+    def start(self):
+        """Starts the background thread."""
+        self._thread.start()
+
+    def wake(self):
+        """Wakes the background thread, e.g. after changing the clock mode."""
+        with self._cond:
+            self._cond.notify()
+
+    @property
+    def pending(self) -> int:
+        """Gets the number of scheduled callbacks, including cancelled ones
+        that have not been removed yet."""
+        return len(self._queue)
+
+    def call_at(self, when: float, callback: Callable[[], None]) -> list:
+        """Schedules a callback.
+
+        Parameters
+        ----------
+        when
+            The time (as returned by :meth:`time`) at which to call
+            ``callback``.
+        callback
+            The function to call.
+
+        Returns
+        -------
+            An opaque handle that can be passed to :meth:`cancel`.
+        """
+        event = [when, next(self._seq), callback]
+        with self._cond:
+            heapq.heappush(self._queue, event)
+            self._cond.notify()
+        return event
+
+    def call_later(self, delay: float, callback: Callable[[], None]) -> list:
+        """Schedules a callback ``delay`` seconds from now."""
+        return self.call_at(self.time() + delay, callback)
+
+    def cancel(self, event: list):
+        """Cancels a callback scheduled with :meth:`call_at`.
+
+        It is not an error to cancel a callback that has already run.
+        """
+        event[2] = None
+
+    def _next_time(self) -> float:
+        # must be called with self._cond held
+        while self._queue and self._queue[0][2] is None:
+            heapq.heappop(self._queue)
+        return self._queue[0][0] if self._queue else None
+
+    def run_pending(self):
+        """Runs all callbacks that are due, in order."""
+        with self._run_lock:
+            while True:
+                with self._cond:
+                    when = self._next_time()
+                    if when is None or when > self.time():
+                        return
+                    callback = heapq.heappop(self._queue)[2]
+                start = time.perf_counter()
+                try:
+                    callback()
+                except Exception:
+                    # stdout is the control channel, so errors go to stderr
+                    traceback.print_exc()
+                tracer = self.tracer
+                if tracer:
+                    name = getattr(callback, '__qualname__', 'callback')
+                    tracer.add(name, 'scheduler', '', start,
+                               time.perf_counter())
+
+    def step(self, seconds: float):
+        """Advances the clock, running each callback that becomes due at the
+        time it was scheduled for.
+
+        This is deterministic, so it is normally used with a paused clock.
+        """
+        end = self.time() + seconds
+        while True:
+            with self._cond:
+                when = self._next_time()
+            if when is None or when > end:
+                break
+            self.clock.advance_to(when)
+            self.run_pending()
+        self.clock.advance_to(end)
+        self.run_pending()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    when = self._next_time()
+                    if when is None:
+                        self._cond.wait()
+                        continue
+                    delay = self.clock.real_delay(when)
+                    if delay is None:
+                        # paused
+                        self._cond.wait()
+                        continue
+                    if self.clock.fast_forward:
+                        self.clock.advance_to(when)
+                    if delay <= 0:
+                        break
+                    self._cond.wait(delay)
+            self.run_pending()
@@ -0,0 +1,81 @@
+import threading
+
+from typing import Dict
+
+# bucket n holds durations shorter than 2**n ns, so 40 buckets go up to ~18 min
+_BUCKETS = 40
+
+
+class Histogram():
+    """Counts durations in power-of-two buckets."""
+    def __init__(self):
+        self.count = 0
+        self.total_ns = 0
+        self.max_ns = 0
+        self.buckets = [0] * _BUCKETS
+
+    def add(self, ns: int):
+        """Adds a duration in nanoseconds."""
+        self.count += 1
+        self.total_ns += ns
+        if ns > self.max_ns:
+            self.max_ns = ns
+        self.buckets[min(ns.bit_length(), _BUCKETS - 1)] += 1
+
+    def percentile(self, p: float) -> float:
+        """Estimates the ``p``-th percentile (0-100) in nanoseconds.
+
+        The result is the upper bound of the bucket the percentile falls in,
+        so it is at most 2 times too high.
+        """
+        target = self.count * p / 100
+        seen = 0
+        for n, c in enumerate(self.buckets):
+            seen += c
+            if c and seen >= target:
+                return min(2 ** n, self.max_ns)
+        return 0
+
+    def to_dict(self) -> dict:
+        """Gets a JSON-friendly summary with times in microseconds."""
+        return {
+            'count': self.count,
+            'total_us': self.total_ns / 1000,
+            'mean_us': self.total_ns / self.count / 1000 if self.count else 0,
+            'max_us': self.max_ns / 1000,
+            'p50_us': self.percentile(50) / 1000,
+            'p99_us': self.percentile(99) / 1000,
+            # upper bound of each non-empty bucket and its count
+            'histogram': [[2 ** n / 1000, c]
+                          for n, c in enumerate(self.buckets) if c],
+        }
+
+
+class Stats():
+    """Thread-safe collection of named histograms."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+
+    def record(self, name: str, seconds: float):
+        """Adds a duration to the histogram called ``name``."""
+        ns = int(seconds * 1e9)
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram()
+            histogram.add(ns)
+
+    def to_dict(self, reset: bool = False) -> Dict[str, dict]:
+        """Gets all histograms, see :meth:`Histogram.to_dict`.
+
+        Parameters
+        ----------
+        reset
+            When ``True``, all histograms are cleared after reading them.
+        """
+        with self._lock:
+            result = {k: v.to_dict() for k, v in self._histograms.items()}
+            if reset:
+                self._histograms = {}
+        return result
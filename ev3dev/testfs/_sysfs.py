@@ -1,17 +1,48 @@
+import collections
+import functools
+import hashlib
+import importlib
 import itertools
+import math
 import os
+import posixpath
+import re
+import sys
 import threading
+import time
+import traceback
+import tracemalloc
 
 import fuse
 
-from errno import EACCES, ENOENT, ENOTSUP
-from stat import S_IFDIR, S_IFREG
+from errno import EACCES, EINVAL, EIO, ENOENT, ENOTSUP
+from select import POLLPRI
+from stat import S_IFDIR, S_IFLNK, S_IFREG
+from typing import Pattern, Tuple
 
 from ..testfs import encode_bytes, decode_bytes
+from ._generators import Generator
+from ._optrace import Tracer
+from ._profiler import SamplingProfiler
+from ._recorder import Recorder
+from ._rules import RuleTable
+from ._sched import Scheduler
+from ._stats import Stats
+from ._trace import Replay
 from ._util import encode_dict, decode_dict
 
 fuse.fuse_python_api = (0, 2)
 
+# same as the kernel's MAXSYMLINKS
+_MAX_LINKS = 40
+
+# the number of changes kept for CHANGES
+_CHANGE_LOG_SIZE = 4096
+
+# commands that can take a long time and run on their own thread so that
+# other commands are not held up
+_BLOCKING_COMMANDS = {'WAIT'}
+
 _ROOT = {
     'type': 'directory',
     'name': '/',
@@ -20,6 +51,32 @@ _ROOT = {
 }
 
 
+def _instrumented(name: str):
+    # Decorator that records how long each call of a method takes in
+    # self._stats under the given name and in self._tracer when tracing.
+    # FUSE operations are also given to self._recorder when recording. The
+    # first argument of the method must be the path.
+    category = 'lookup' if name == 'lookup' else 'fuse'
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args):
+            start = time.perf_counter()
+            recorder = self._recorder
+            if recorder and category == 'fuse':
+                recorder.add(name, args[0], args[1:], start)
+            try:
+                return func(self, *args)
+            finally:
+                end = time.perf_counter()
+                self._stats.record(name, end - start)
+                tracer = self._tracer
+                if tracer:
+                    tracer.add(name, category, args[0], start, end)
+        return wrapper
+    return decorator
+
+
 class SysfsStat(fuse.Stat):
     def __init__(self):
         self.st_mode = 0
@@ -34,74 +91,892 @@ class SysfsStat(fuse.Stat):
         self.st_ctime = 0
 
 
+def _compile_callback(name: str, plugin: str = None, expression: str = None):
+    # Returns a function (path, item, time, count) that computes the contents
+    # of a file. Plugins are given as 'module:function' and are called with
+    # the path, the tree node and the time. Expressions can use the names
+    # path, node, time, count (number of previous calls) and math.
+    if plugin:
+        module, _, attr = plugin.partition(':')
+        func = getattr(importlib.import_module(module), attr)
+        return lambda path, item, time, count: func(path, item, time)
+    if expression:
+        code = compile(expression, name, 'eval')
+        return lambda path, item, time, count: eval(code, {'math': math}, {
+            'path': path, 'node': item, 'time': time, 'count': count})
+    raise ValueError('Either plugin or expression is required')
+
+
+def _expand_template(contents: list, params: dict) -> list:
+    # Returns a copy of the contents of a template directory with each
+    # '{param}' in names and file contents replaced by its value. File
+    # contents are filled as bytes, since they don't have to be text.
+    def fill(text):
+        for k, v in params.items():
+            key, value = '{' + k + '}', str(v)
+            if isinstance(text, bytes):
+                key, value = key.encode(), value.encode()
+            text = text.replace(key, value)
+        return text
+
+    result = []
+    for node in contents:
+        node = dict(node, name=fill(node['name']))
+        if node['type'] == 'directory' and 'contents' in node:
+            node['contents'] = _expand_template(node['contents'], params)
+        elif node['type'] == 'file':
+            data = decode_bytes(node['contents'])
+            node['contents'] = encode_bytes(fill(data))
+        elif node['type'] == 'link':
+            node['target'] = fill(node['target'])
+        result.append(node)
+    return result
+
+
+def _prune(node: dict, depth: int) -> dict:
+    # returns a copy of a tree without the contents of directories that are
+    # more than depth levels below node
+    if node['type'] != 'directory' or 'contents' not in node:
+        return node
+    node = dict(node)
+    if depth <= 0:
+        del node['contents']
+    else:
+        node['contents'] = [_prune(x, depth - 1) for x in node['contents']]
+    return node
+
+
+def _diff(old: dict, new: dict, path: str):
+    # Yields (path, kind) for the differences between two trees, with kinds
+    # like in SysfsFuse._changed(). Trees that share nodes are compared in
+    # time proportional to the number of nodes that are not shared.
+    if old is new:
+        return
+    if (old['type'] != 'directory' or new['type'] != 'directory'
+            or 'contents' not in old or 'contents' not in new):
+        yield path, 'node'
+        return
+    old_contents = {x['name']: x for x in old['contents']}
+    new_contents = {x['name']: x for x in new['contents']}
+    if (list(old_contents) != list(new_contents) or old.keys() != new.keys()
+            or any(old[k] != new[k] for k in old.keys() - {'contents'})):
+        yield path, 'attrs'
+    for name in old_contents.keys() | new_contents.keys():
+        child_path = posixpath.join(path, name)
+        if name in old_contents and name in new_contents:
+            yield from _diff(old_contents[name], new_contents[name],
+                             child_path)
+        else:
+            yield child_path, 'node'
+
+
+def _walk(node: dict):
+    # yields all nodes of a tree, not expanding lazy directories
+    yield node
+    if node['type'] == 'directory':
+        for child in node.get('contents', []):
+            yield from _walk(child)
+
+
+class _OpenFile():
+    # Returned by open() for files with computed contents. Like real sysfs,
+    # the contents are computed when reading at offset 0 and reused for the
+    # rest of the read.
+
+    # tells fuse-python to bypass the page cache so that every read reaches
+    # the read() method
+    direct_io = True
+    keep_cache = False
+
+    def __init__(self):
+        self.contents = None
+
+
+class _Waiter():
+    # A WAIT command waiting for a write to a file. The path must not contain
+    # links since the kernel resolves them before calling write().
+
+    def __init__(self, path: str, pattern: Pattern = None):
+        self.path = path
+        self.pattern = pattern
+        self.data = None
+        self.event = threading.Event()
+
+    def check(self, path: str, data: bytes):
+        if path != self.path or self.event.is_set():
+            return
+        if self.pattern and not self.pattern.fullmatch(data):
+            return
+        self.data = data
+        self.event.set()
+
+
 class SysfsFuse(fuse.Fuse):
     def __init__(self):
         super().__init__()
         self._root = dict(_ROOT)
         self._thread = threading.Thread(target=self._run, daemon=True)
         self._poll_handles = {}
+        self._scheduler = Scheduler()
+        self._replays = {}
+        self._generators = {}
+        self._generator_events = {}
+        self._callbacks = {}
+        self._callback_counts = {}
+        self._rules = RuleTable([])
+        self._templates = {}
+        self._stats = Stats()
+        self._tracer = None
+        self._profiler = None
+        self._recorder = None
+        self._waiters = []
+        self._waiters_lock = threading.Lock()
+        # held while the tree is changed or file contents are read, so that
+        # changes to several files (MSET, write rules, replays) are seen all
+        # at once and nodes are not shared by a snapshot while being changed
+        self._contents_lock = threading.RLock()
+        # Snapshots share nodes with the tree. Nodes are copied before they
+        # are changed unless their id() is in _owned, which means they were
+        # copied after the last snapshot. None means that nothing is shared.
+        self._snapshots = {}
+        self._owned = None
+        # the tree given to BASE SET and the SHA-1 of its encoded form
+        self._base = None
+        self._base_digest = None
+        self._stdout_lock = threading.Lock()
+        # incremented on every change to the tree so that clients can tell
+        # whether their copy is current
+        self._generation = 0
+        self._generation_lock = threading.Lock()
+        # (generation, path, kind) of recent changes, see _changed()
+        self._changes = collections.deque(maxlen=_CHANGE_LOG_SIZE)
 
     def _parse_line(self, line: str) -> str:
+        start = time.perf_counter()
         try:
             line = line.split()
-            if line[0] == 'GET':
-                return 'OK {}'.format(encode_dict(self._root))
-            if line[0] == 'SET':
-                self._root = decode_dict(line[1])
+            handler = getattr(self, '_cmd_' + line[0].lower(), None)
+            if not handler:
+                raise ValueError('Unknown command: {}'.format(line[0]))
+            try:
+                reply = handler(*line[1:])
+            finally:
+                end = time.perf_counter()
+                self._stats.record(line[0], end - start)
+                tracer = self._tracer
+                if tracer:
+                    path = line[1] if line[1:] and line[1][0] == '/' else ''
+                    tracer.add(line[0], 'control', path, start, end)
+            if reply is None:
                 return 'OK'
-            if line[0] == 'NOTIFY':
-                path = line[1]
-                item = self._get_item(path)
-                if not item:
-                    raise ValueError('Not a valid path')
+            return 'OK {}'.format(reply)
+        except Exception as ex:
+            return 'ERR {}'.format(ex)
 
-                # set the event flags
-                item['poll_events'] = int(line[2])
+    def _cmd_get(self, path=None, depth=None):
+        if path is None:
+            return encode_dict(self._root)
+        item = self._get_item(path)
+        if not item:
+            raise ValueError('Not a valid path')
+        if depth is not None:
+            item = _prune(item, int(depth))
+        return encode_dict(item)
 
-                # if there is a poll handle, notify (calls poll method)
-                if path in self._poll_handles:
-                    self.NotifyPoll(self._poll_handles[path])
-                    del self._poll_handles[path]
+    def _cmd_set(self, tree):
+        tree = decode_dict(tree)
+        with self._contents_lock:
+            self._root = tree
+            self._owned = None
+            self._changed('/', 'reset')
 
-                return 'OK'
-            raise ValueError('Unknown command: {}'.format(line[0]))
-        except Exception as ex:
-            return 'ERR {}'.format(ex)
+    def _cmd_snapshot(self, subcommand, name):
+        with self._contents_lock:
+            if subcommand == 'SAVE':
+                # the tree is shared instead of copied, so this takes the
+                # same time for any size of tree
+                self._snapshots[name] = self._root
+                self._owned = set()
+            elif subcommand == 'RESTORE':
+                if name not in self._snapshots:
+                    raise ValueError('Unknown snapshot: {}'.format(name))
+                self._restore(self._snapshots[name])
+            elif subcommand == 'DROP':
+                if self._snapshots.pop(name, None) is None:
+                    raise ValueError('Unknown snapshot: {}'.format(name))
+            else:
+                raise ValueError('Unknown subcommand: {}'.format(subcommand))
+
+    def _cmd_base(self, subcommand, *args):
+        # The base is never changed. Everything is changed in copies of its
+        # nodes, which make up the overlay, so dropping the overlay is the
+        # same as restoring a snapshot.
+        with self._contents_lock:
+            if subcommand == 'SET':
+                tree = decode_dict(args[0])
+                self._base = self._root = tree
+                self._base_digest = hashlib.sha1(args[0].encode()).hexdigest()
+                self._owned = set()
+                self._changed('/', 'reset')
+                return self._base_digest
+            if subcommand == 'USE':
+                # lets clients skip sending a base that is already loaded
+                if args[0] != self._base_digest:
+                    return '0'
+            elif subcommand != 'RESET':
+                raise ValueError('Unknown subcommand: {}'.format(subcommand))
+            if self._base is None:
+                raise ValueError('No base tree')
+            self._restore(self._base)
+            # per-test state that is not part of the tree
+            for path in list(self._replays):
+                self._stop_replay(path)
+            for event in self._generator_events.values():
+                self._scheduler.cancel(event)
+            self._generator_events.clear()
+            self._generators.clear()
+            self._callback_counts.clear()
+            return '1' if subcommand == 'USE' else None
+
+    def _restore(self, root: dict):
+        # must be called with _contents_lock held
+        old, self._root = self._root, root
+        self._owned = set()
+        # only nodes that were changed since root was saved differ
+        for path, kind in _diff(old, root, '/'):
+            self._changed(path, kind)
+
+    def _cmd_changes(self, generation):
+        generation = int(generation)
+        with self._generation_lock:
+            current = self._generation
+            log = [x for x in self._changes if x[0] > generation]
+        if generation == current:
+            return None
+
+        # the whole tree is sent when the log doesn't go back far enough
+        if (generation > current or not log or log[0][0] != generation + 1
+                or any(kind == 'reset' for _, _, kind in log)):
+            return '{} tree {}'.format(current, encode_dict(self._root))
+
+        # Only the current state of each changed path is sent, in the order
+        # the paths first changed. A path that no longer exists is deleted.
+        kinds = {}
+        for _, path, kind in log:
+            if kinds.get(path) != 'node':
+                kinds[path] = kind
+        changes = []
+        for path, kind in kinds.items():
+            item, _ = self._lookup(path)
+            if not item:
+                changes.append(['delete', path])
+            elif kind == 'attrs':
+                # the names give the order of the contents, which changes
+                # when a node is removed and added again
+                changes.append(['attrs', path, {
+                    k: v for k, v in item.items() if k != 'contents'},
+                    [x['name'] for x in item.get('contents', [])]])
+            else:
+                changes.append(['node', path, item])
+        return '{} changes {}'.format(current,
+                                      encode_dict({'changes': changes}))
+
+    def _cmd_notify(self, path, events):
+        item, path = self._lookup(path)
+        if not item:
+            raise ValueError('Not a valid path')
+
+        self._notify(path, int(events))
+
+    def _cmd_read(self, path):
+        # looked up with the lock held, like in read()
+        with self._contents_lock:
+            _, path = self._lookup(path)
+            return encode_bytes(self._render(path, self._get_file(path)))
+
+    def _cmd_mget(self, *paths):
+        with self._contents_lock:
+            paths = [self._lookup(path)[1] for path in paths]
+            items = [self._get_file(path) for path in paths]
+            values = [encode_bytes(self._render(path, item))
+                      for path, item in zip(paths, items)]
+        return encode_dict({'values': values})
+
+    def _cmd_mset(self, values):
+        values = decode_dict(values)
+        # check everything before changing anything
+        items = []
+        for path, data in values.items():
+            decode_bytes(data)
+            item, path = self._lookup(path)
+            if not item or item['type'] != 'file':
+                raise ValueError('Not a valid file path: {}'.format(path))
+            items.append((path, data))
+        with self._contents_lock:
+            for path, data in items:
+                self._writable(path)['contents'] = data
+                self._changed(path, 'node')
+
+    def _cmd_put(self, path, data=''):
+        # check for errors before changing anything
+        decode_bytes(data)
+        item, path = self._lookup(path)
+        if not item:
+            self._insert(path, {'type': 'file', 'mode': 0o644,
+                                'contents': data})
+        elif item['type'] == 'file':
+            with self._contents_lock:
+                self._writable(path)['contents'] = data
+                self._changed(path, 'node')
+        else:
+            raise ValueError('Not a valid file path')
+
+    def _cmd_delete(self, path):
+        self._delete(path)
+
+    def _cmd_exists(self, path):
+        return '1' if self._get_item(path) else '0'
+
+    def _cmd_wait(self, path, timeout, pattern=None, flags=0):
+        _, path = self._lookup(path)
+        self._get_file(path)
+        if pattern is not None:
+            pattern = re.compile(decode_bytes(pattern), int(flags))
+        waiter = _Waiter(path, pattern)
+        # replace the list instead of changing it so that write() can loop
+        # over it without a lock
+        with self._waiters_lock:
+            self._waiters = self._waiters + [waiter]
+        try:
+            if not waiter.event.wait(float(timeout)):
+                # no payload means timeout, a match always has one
+                return None
+        finally:
+            with self._waiters_lock:
+                self._waiters = [w for w in self._waiters if w is not waiter]
+        return encode_dict({'data': encode_bytes(waiter.data)})
+
+    def _cmd_replay(self, subcommand, arg):
+        if subcommand == 'START':
+            self._start_replay(**decode_dict(arg))
+        elif subcommand == 'STOP':
+            self._stop_replay(arg)
+        else:
+            raise ValueError('Unknown subcommand: {}'.format(subcommand))
+
+    def _cmd_generator(self, subcommand, path, *args):
+        _, path = self._lookup(path)
+        self._get_file(path)
+        if subcommand not in ('SET', 'CLEAR'):
+            raise ValueError('Unknown subcommand: {}'.format(subcommand))
+        if subcommand == 'SET':
+            decl = decode_dict(args[0])
+            decl.setdefault('start', self._scheduler.time())
+            # a bad declaration must not replace the current one, so the
+            # generator is made before anything is changed
+            generator = Generator(decl['kind'], decl['rate'], decl['start'],
+                                  decl.get('format'),
+                                  **decl.get('params', {}))
+        with self._contents_lock:
+            item = self._writable(path)
+            if subcommand == 'SET':
+                item['generator'] = decl
+                self._generators[path] = (decl, generator)
+            else:
+                item.pop('generator', None)
+                self._generators.pop(path, None)
+            self._changed(path, 'node')
+
+    def _cmd_callback(self, subcommand, *args):
+        if subcommand == 'REGISTER':
+            self._callbacks[args[0]] = _compile_callback(
+                args[0], **decode_dict(args[1]))
+        elif subcommand == 'SET':
+            path, name = args
+            if name not in self._callbacks:
+                raise ValueError('Unknown callback: {}'.format(name))
+            _, path = self._lookup(path)
+            self._get_file(path)
+            with self._contents_lock:
+                self._writable(path)['callback'] = name
+                self._changed(path, 'node')
+        elif subcommand == 'CLEAR':
+            _, path = self._lookup(args[0])
+            self._get_file(path)
+            with self._contents_lock:
+                self._writable(path).pop('callback', None)
+                self._changed(path, 'node')
+        else:
+            raise ValueError('Unknown subcommand: {}'.format(subcommand))
+
+    def _cmd_clock(self, subcommand, *args):
+        clock = self._scheduler.clock
+        if subcommand == 'PAUSE':
+            clock.pause()
+        elif subcommand == 'RUN':
+            clock.run(float(args[0]) if args else 1.0)
+        elif subcommand == 'FAST':
+            clock.start_fast_forward()
+        elif subcommand == 'STEP':
+            self._scheduler.step(int(args[0]) / 1000)
+        elif subcommand == 'TIME':
+            return repr(clock.time())
+        else:
+            raise ValueError('Unknown subcommand: {}'.format(subcommand))
+        self._scheduler.wake()
+
+    def _cmd_hotplug(self, subcommand, params):
+        params = decode_dict(params)
+        if subcommand == 'ADD':
+            self._add_device(**params)
+        elif subcommand == 'REMOVE':
+            self._remove_device(**params)
+        else:
+            raise ValueError('Unknown subcommand: {}'.format(subcommand))
+
+    def _cmd_template(self, name, node):
+        node = decode_dict(node)
+        if node.get('type') != 'directory':
+            raise ValueError('Template must be a directory')
+        # catch errors now instead of when the template is expanded
+        _expand_template(node['contents'], {})
+        self._templates[name] = node
+
+    def _cmd_stats(self, *args):
+        return encode_dict(self._stats.to_dict(reset=args == ('RESET',)))
+
+    def _cmd_tracing(self, subcommand, *args):
+        if subcommand == 'START':
+            self._tracer = Tracer(*map(int, args))
+        elif subcommand == 'STOP':
+            self._tracer = None
+        elif subcommand == 'DUMP':
+            if not self._tracer:
+                raise ValueError('Tracing is not started')
+            return encode_dict(self._tracer.to_chrome())
+        else:
+            raise ValueError('Unknown subcommand: {}'.format(subcommand))
+        self._scheduler.tracer = self._tracer
+
+    def _cmd_profile(self, subcommand, *args):
+        if subcommand == 'START':
+            if self._profiler:
+                raise ValueError('Profiler is already running')
+            interval = float(args[0]) / 1000 if args else 0.001
+            # where the server threads wait for something to do, the main
+            # thread stays in fuse.Fuse.main() while the FUSE threads work
+            idle = [
+                SysfsFuse._run.__code__, threading.Condition.wait.__code__,
+                SysfsFuse.main.__code__, fuse.Fuse.main.__code__,
+            ]
+            self._profiler = SamplingProfiler(interval, idle)
+            self._profiler.start()
+        elif subcommand == 'STOP':
+            if not self._profiler:
+                raise ValueError('Profiler is not running')
+            profiler, self._profiler = self._profiler, None
+            return encode_dict(profiler.stop())
+        else:
+            raise ValueError('Unknown subcommand: {}'.format(subcommand))
+
+    def _cmd_record(self, subcommand):
+        if subcommand == 'START':
+            self._recorder = Recorder(encode_dict(self._root))
+        elif subcommand == 'STOP':
+            if not self._recorder:
+                raise ValueError('Recording is not started')
+            recorder, self._recorder = self._recorder, None
+            return encode_bytes(recorder.dumps().encode())
+        else:
+            raise ValueError('Unknown subcommand: {}'.format(subcommand))
+
+    def _cmd_memory(self, *args):
+        if args[:1] == ('START',):
+            tracemalloc.start(*map(int, args[1:]))
+        elif args[:1] == ('STOP',):
+            tracemalloc.stop()
+        elif args:
+            raise ValueError('Unknown subcommand: {}'.format(args[0]))
+        else:
+            return encode_dict(self._memory_usage())
+
+    def _memory_usage(self) -> dict:
+        usage = {}
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(('VmRSS:', 'VmHWM:')):
+                    # values are in kB
+                    name, value, _ = line.split()
+                    usage[name[:-1].lower() + '_bytes'] = int(value) * 1024
+
+        # structures that could grow while the filesystem is in use
+        # the data is stored base64 encoded, but the size written counts
+        write_data = [len(decode_bytes(item['write_data']))
+                      for item in _walk(self._root) if 'write_data' in item]
+        usage['structures'] = {
+            'poll_handles': len(self._poll_handles),
+            'write_data_items': len(write_data),
+            'write_data_bytes': sum(write_data),
+            'replays': len(self._replays),
+            'generators': len(self._generators),
+            'generator_events': len(self._generator_events),
+            'callback_counts': len(self._callback_counts),
+            'scheduler_pending': self._scheduler.pending,
+            'rules_cache': self._rules.cache_size,
+            'snapshots': len(self._snapshots),
+            'overlay_nodes': len(self._owned or ()),
+        }
+
+        if tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            snapshot = tracemalloc.take_snapshot()
+            usage['tracemalloc'] = {
+                'current_bytes': current,
+                'peak_bytes': peak,
+                'top': [[str(s.traceback), s.size, s.count]
+                        for s in snapshot.statistics('lineno')[:20]],
+            }
+
+        return usage
+
+    def _cmd_rules(self, rules):
+        self._rules = RuleTable(decode_dict(rules))
+
+    def _get_file(self, path: str) -> dict:
+        item = self._get_item(path)
+        if not item or item['type'] != 'file':
+            raise ValueError('Not a valid file path')
+        return item
+
+    def _get_dir(self, path: str) -> dict:
+        return self._lookup_dir(path)[0]
+
+    def _lookup_dir(self, path: str) -> Tuple[dict, str]:
+        # like _lookup() but only finds directories, which are expanded
+        item, path = self._lookup(path)
+        if not item or item['type'] != 'directory':
+            return None, path
+        if 'lazy' in item:
+            item = self._expand(path)
+        return item, path
+
+    def _check_insert(self, path: str) -> str:
+        # Returns the path without links where a new node would be inserted
+        # or raises ValueError if it can't be.
+        parent_path, name = posixpath.split(path.rstrip('/'))
+        parent, parent_path = self._lookup_dir(parent_path)
+        if not parent:
+            raise ValueError('Not a valid directory path: {}'.format(
+                parent_path))
+        if any(x['name'] == name for x in parent['contents']):
+            raise ValueError('Path already exists: {}'.format(path))
+        return posixpath.join(parent_path, name)
+
+    def _check_delete(self, path: str) -> str:
+        # Returns the path without links of a node that can be deleted or
+        # raises ValueError.
+        parent_path, name = posixpath.split(path.rstrip('/'))
+        parent, parent_path = self._lookup_dir(parent_path)
+        if not parent or not any(x['name'] == name
+                                 for x in parent['contents']):
+            raise ValueError('Not a valid path: {}'.format(path))
+        return posixpath.join(parent_path, name)
+
+    def _insert(self, path: str, node: dict):
+        with self._contents_lock:
+            path = self._check_insert(path)
+            parent_path, name = posixpath.split(path)
+            node = dict(node, name=name)
+            parent = self._writable(parent_path)
+            # replace the list instead of appending to it so that a
+            # concurrent readdir sees either the old or the new contents
+            parent['contents'] = parent['contents'] + [node]
+            self._dir_changed(parent_path, parent)
+            self._changed(posixpath.join(parent_path, name), 'node')
+
+    def _delete(self, path: str):
+        with self._contents_lock:
+            path = self._check_delete(path)
+            parent_path, name = posixpath.split(path)
+            parent = self._writable(parent_path)
+            parent['contents'] = [x for x in parent['contents']
+                                  if x['name'] != name]
+            self._dir_changed(parent_path, parent)
+            self._changed(path, 'node')
+
+        # Like real sysfs, wake up anyone polling an attribute of the removed
+        # device. Their next poll() fails, which shows up as POLLERR.
+        prefix = path + '/'
+        for p in [p for p in self._poll_handles if p.startswith(prefix)]:
+            self.NotifyPoll(self._poll_handles.pop(p))
+        for cache in (self._generators, self._callback_counts):
+            for p in [p for p in cache if p.startswith(prefix)]:
+                del cache[p]
+
+    def _changed(self, path: str, kind: str):
+        # Records a change to the tree. The path must not contain links. The
+        # kind is 'node' when the node at path was added, removed or changed
+        # in any way, 'attrs' when only the attributes of a directory (not
+        # its contents) changed and 'reset' when the whole tree was replaced.
+        with self._generation_lock:
+            self._generation += 1
+            self._changes.append((self._generation, path, kind))
+
+    def _writable(self, path: str) -> dict:
+        # Gets the node at path, which must exist and not contain links, so
+        # that it can be changed. Nodes that are shared with a snapshot are
+        # copied first, along with the directories above them. Must be called
+        # with _contents_lock held, until the changes are done.
+        owned = self._owned
+        node = self._root
+        if owned is not None and id(node) not in owned:
+            node = self._root = self._own(node)
+        for name in [n for n in path.split('/') if n]:
+            contents = node['contents']
+            i = next(i for i, x in enumerate(contents) if x['name'] == name)
+            child = contents[i]
+            if owned is not None and id(child) not in owned:
+                child = self._own(child)
+                # contents lists are shared too, so they are always replaced
+                # instead of changed
+                node['contents'] = contents[:i] + [child] + contents[i + 1:]
+            node = child
+        return node
+
+    def _own(self, node: dict) -> dict:
+        node = dict(node)
+        self._owned.add(id(node))
+        return node
+
+    def _dir_changed(self, path: str, item: dict):
+        # item must come from _writable()
+        item['mtime'] = time.time()
+        self._changed(path, 'attrs')
+        poll_handle = self._poll_handles.pop(path, None)
+        if poll_handle:
+            self.NotifyPoll(poll_handle)
+
+    def _add_device(self, path: str, node: dict, link: str = None):
+        if node.get('type') != 'directory':
+            raise ValueError('Device node must be a directory')
+        # Both paths are checked before changing anything and the lock is
+        # held throughout, so the device and its link appear together.
+        with self._contents_lock:
+            path = self._check_insert(path)
+            if link:
+                link = self._check_insert(link)
+                if link == path:
+                    raise ValueError('Path already exists: {}'.format(link))
+            self._insert(path, node)
+            if link:
+                # like /sys/class/*/* -> ../../devices/...
+                target = posixpath.relpath(path, posixpath.dirname(link))
+                self._insert(link, {
+                    'type': 'link',
+                    'mode': 0o777,
+                    'target': target,
+                })
+
+    def _remove_device(self, path: str, link: str = None):
+        # like _add_device(), the device and its link disappear together
+        with self._contents_lock:
+            path = self._check_delete(path)
+            if link:
+                link = self._check_delete(link)
+                if link == path:
+                    raise ValueError('Not a valid path: {}'.format(link))
+                self._delete(link)
+            self._delete(path)
+
+    def _expand(self, path: str) -> dict:
+        # Returns the expanded directory, which can be a copy of the one that
+        # was looked up, or None when the template is not registered.
+        with self._contents_lock:
+            item = self._writable(path)
+            if 'lazy' not in item:
+                # another thread got here first
+                return item
+            lazy = item['lazy']
+            template = self._templates.get(lazy['template'])
+            if template is None:
+                # stdout is the control channel, so errors go to stderr
+                print('{}: Unknown template: {}'.format(
+                    path, lazy['template']), file=sys.stderr)
+                return None
+            # contents must be set before 'lazy' is removed so that other
+            # threads never see a directory without contents
+            item['contents'] = _expand_template(template['contents'],
+                                                lazy.get('params', {}))
+            item.pop('lazy', None)
+            self._changed(path, 'node')
+        return item
+
+    def _notify(self, path: str, events: int):
+        # set the event flags
+        with self._contents_lock:
+            self._writable(path)['poll_events'] = events
+            self._changed(path, 'node')
+
+        # if there is a poll handle, notify (calls poll method)
+        poll_handle = self._poll_handles.pop(path, None)
+        if poll_handle:
+            self.NotifyPoll(poll_handle)
+
+    def _start_replay(self, path: str, filename: str, speed: float = 1.0,
+                      loop: bool = False):
+        item = self._get_item(path)
+        if not item or item['type'] != 'directory':
+            raise ValueError('Not a valid directory path')
+
+        def apply(values):
+            with self._contents_lock:
+                for n, value in enumerate(values):
+                    value_path = '{}/value{}'.format(path.rstrip('/'), n)
+                    value_item, value_path = self._lookup(value_path)
+                    if not value_item:
+                        # the trace has more columns than the sensor has
+                        # values
+                        continue
+                    data = encode_bytes(value.encode() + b'\n')
+                    self._writable(value_path)['contents'] = data
+                    self._notify(value_path, POLLPRI)
+
+        self._stop_replay(path)
+        replay = Replay(self._scheduler, filename, apply, speed, loop)
+        replay.start()
+        self._replays[path] = replay
+
+    def _stop_replay(self, path: str):
+        replay = self._replays.pop(path, None)
+        if replay:
+            replay.stop()
+
+    def _get_generator(self, path: str, item: dict) -> Generator:
+        decl = item['generator']
+        cached = self._generators.get(path)
+        if cached and cached[0] is decl:
+            return cached[1]
+
+        if 'start' not in decl:
+            # the declaration can be shared with a snapshot, so it is
+            # replaced instead of changed
+            with self._contents_lock:
+                item = self._writable(path)
+                decl = item['generator'] = dict(decl,
+                                                start=self._scheduler.time())
+                self._changed(path, 'node')
+        generator = Generator(decl['kind'], decl['rate'], decl['start'],
+                              decl.get('format'), **decl.get('params', {}))
+        self._generators[path] = (decl, generator)
+        return generator
+
+    def _schedule_generator_notify(self, path: str, item: dict):
+        # The lock is held so that fire() can't run before the event is
+        # saved. fire() checks that it is still the saved event, since events
+        # are dropped without running when the overlay is dropped.
+        with self._contents_lock:
+            if path in self._generator_events:
+                return
+
+            def fire():
+                with self._contents_lock:
+                    if self._generator_events.get(path) is not event:
+                        return
+                    del self._generator_events[path]
+                    if self._get_item(path):
+                        self._notify(path, POLLPRI)
+
+            now = self._scheduler.time()
+            when = self._get_generator(path, item).next_change(now)
+            event = self._scheduler.call_at(when, fire)
+            self._generator_events[path] = event
+
+    def _render(self, path: str, item: dict) -> bytes:
+        if 'callback' in item:
+            count = self._callback_counts.get(path, 0)
+            self._callback_counts[path] = count + 1
+            callback = self._callbacks[item['callback']]
+            value = callback(path, item, self._scheduler.time(), count)
+            if isinstance(value, bytes):
+                return value
+            return str(value).encode() + b'\n'
+        if 'generator' in item:
+            generator = self._get_generator(path, item)
+            return generator.value(self._scheduler.time())
+        return decode_bytes(item['contents'])
 
     def _run(self):
         print('READY', flush=True)
         while True:
             line = input()
-            print(self._parse_line(line), flush=True)
+            # commands can start with '#<id>', which is copied to the reply
+            # so that clients can have several commands in progress
+            tag = ''
+            if line.startswith('#'):
+                tag, _, line = line.partition(' ')
+            if line.split(' ', 1)[0].upper() in _BLOCKING_COMMANDS:
+                threading.Thread(target=self._reply, args=(tag, line),
+                                 daemon=True).start()
+            else:
+                self._reply(tag, line)
 
-    def _get_item(self, path: str) -> dict:
-        current = None
-        for n in path.split('/'):
-            if n == '':
-                if current:
-                    # trailing '/'
-                    continue
-                # leading '/' means root node
-                current = self._root
+    def _reply(self, tag: str, line: str):
+        reply = self._parse_line(line)
+        with self._stdout_lock:
+            if tag:
+                print(tag, reply, flush=True)
             else:
-                # must be child of current directory
-                if current['type'] != 'directory':
-                    # path was not found
-                    return None
+                print(reply, flush=True)
+
+    def _get_item(self, path: str) -> dict:
+        return self._lookup(path)[0]
 
-                match = (x for x in current['contents'] if x['name'] == n)
-                current = next(match, None)
+    @_instrumented('lookup')
+    def _lookup(self, path: str) -> Tuple[dict, str]:
+        # Returns the item and the path without links, or None and the given
+        # path when the path is not found. Links are followed, except for the
+        # last part of the path. The kernel resolves links itself, so this
+        # only matters for paths given in control commands.
+        names = [n for n in path.split('/') if n]
+        current = self._root
+        links = 0
+        i = 0
+        while i < len(names):
+            # must be child of current directory
+            if current['type'] != 'directory':
+                # path was not found
+                return None, path
+            if 'lazy' in current:
+                current = self._expand('/' + '/'.join(names[:i]))
+                if not current:
+                    return None, path
 
+            match = (x for x in current['contents'] if x['name'] == names[i])
+            current = next(match, None)
             if not current:
-                return None
+                return None, path
+
+            i += 1
+            if current['type'] == 'link' and i < len(names):
+                links += 1
+                if links > _MAX_LINKS:
+                    return None, path
+                parent = '/' + '/'.join(names[:i - 1])
+                target = posixpath.join(parent, current['target'])
+                names = posixpath.normpath(target).split('/') + names[i:]
+                names = [n for n in names if n]
+                current = self._root
+                i = 0
 
-        return current
+        return current, '/' + '/'.join(names)
 
     def main(self):
         if self.fuse_args.mount_expected():
+            self._scheduler.start()
             self._thread.start()
         super().main()
 
+    @_instrumented('getattr')
     def getattr(self, path):
         item = self._get_item(path)
         if not item:
@@ -113,21 +988,39 @@ class SysfsFuse(fuse.Fuse):
         elif item['type'] == 'file':
             st.st_mode |= S_IFREG
             st.st_size = 4096  # all sysfs files are this size
+        elif item['type'] == 'link':
+            st.st_mode |= S_IFLNK
+            st.st_size = len(item['target'])
         st.st_mode |= item['mode']
+        # directories get a new mtime when devices are added or removed
+        st.st_mtime = st.st_ctime = item.get('mtime', 0)
         return st
 
+    @_instrumented('readlink')
+    def readlink(self, path):
+        item = self._get_item(path)
+        if not item:
+            return -ENOENT
+        if item['type'] != 'link':
+            return -EINVAL
+        return item['target']
+
     def getxattr(self, path, name, size):
         return -ENOTSUP
 
     def setxattr(self, path, name, value, flags):
         return -ENOTSUP
 
+    @_instrumented('readdir')
     def readdir(self, path, offset):
-        item = self._get_item(path)
+        item = self._get_dir(path)
+        if not item:
+            return -ENOENT
         names = (x['name'] for x in item['contents'])
-        for r in itertools.chain(['.', '..'], names):
-            yield fuse.Direntry(r)
+        # a list instead of a generator so that the time spent is measured
+        return [fuse.Direntry(r) for r in itertools.chain(['.', '..'], names)]
 
+    @_instrumented('open')
     def open(self, path, flags):
         item = self._get_item(path)
         if not item:
@@ -145,12 +1038,33 @@ class SysfsFuse(fuse.Fuse):
                 match(os.O_RDWR, 0o060)):
             return -EACCES
 
-    def read(self, path, size, offset):
-        item = self._get_item(path)
-        if not item:
-            return -ENOENT
+        if 'callback' in item or 'generator' in item:
+            return _OpenFile()
+
+    @_instrumented('release')
+    def release(self, path, flags, fh=None):
+        pass
 
-        contents = decode_bytes(item['contents'])
+    @_instrumented('read')
+    def read(self, path, size, offset, fh=None):
+        if fh and offset and fh.contents is not None:
+            if not self._get_item(path):
+                return -ENOENT
+            contents = fh.contents
+        else:
+            try:
+                # looked up with the lock held, since changes can replace
+                # the node with a copy
+                with self._contents_lock:
+                    item = self._get_item(path)
+                    if not item:
+                        return -ENOENT
+                    contents = self._render(path, item)
+            except Exception:
+                traceback.print_exc()
+                return -EIO
+            if fh:
+                fh.contents = contents
         slen = len(contents)
         if offset < slen:
             if offset + size > slen:
@@ -161,16 +1075,39 @@ class SysfsFuse(fuse.Fuse):
 
         return buf
 
-    def write(self, path, buf, offset):
+    @_instrumented('write')
+    def write(self, path, buf, offset, fh=None):
         item = self._get_item(path)
         if not item:
             return -ENOENT
 
-        item['write_data'] = encode_bytes(buf)
-        item['write_offset'] = offset
+        with self._contents_lock:
+            item = self._writable(path)
+            item['write_data'] = encode_bytes(buf)
+            item['write_offset'] = offset
+
+            for updates, events in self._rules.match(path, buf):
+                for target, contents in updates.items():
+                    target_item, target = self._lookup(target)
+                    if target_item and target_item['type'] == 'file':
+                        data = contents.encode() + b'\n'
+                        self._writable(target)['contents'] = encode_bytes(
+                            data)
+                        self._changed(target, 'node')
+                for target, flags in events.items():
+                    target_item, target = self._lookup(target)
+                    if target_item:
+                        self._notify(target, flags)
+
+            self._changed(path, 'node')
+
+        # after the rules so that woken clients see their effects too
+        for waiter in self._waiters:
+            waiter.check(path, buf)
 
         return len(buf)
 
+    @_instrumented('truncate')
     def truncate(self, path, size):
         item = self._get_item(path)
         if not item:
@@ -178,10 +1115,11 @@ class SysfsFuse(fuse.Fuse):
 
         # truncate doesn't do anything in sysfs
 
-    def flush(self, path):
+    def flush(self, path, fh=None):
         pass
 
-    def poll(self, path, poll_handle):
+    @_instrumented('poll')
+    def poll(self, path, poll_handle, fh=None):
         item = self._get_item(path)
         if not item:
             return -ENOENT
@@ -194,9 +1132,15 @@ class SysfsFuse(fuse.Fuse):
         if not events:
             # if events is 0, save the poll handle for later notification
             self._poll_handles[path] = poll_handle
+            if item.get('generator', {}).get('notify'):
+                # generators only notify while someone is waiting
+                self._schedule_generator_notify(path, item)
 
         # clear the events for the next call
-        item['poll_events'] = 0
+        if item.get('poll_events'):
+            with self._contents_lock:
+                self._writable(path)['poll_events'] = 0
+                self._changed(path, 'node')
 
         return events
 
@@ -0,0 +1,128 @@
+import csv
+import threading
+
+from typing import Callable, Iterator, List, Tuple
+
+from ._sched import Scheduler
+
+Sample = Tuple[float, List[str]]
+
+
+def read_csv(filename: str) -> Iterator[Sample]:
+    """Read samples from a recorded trace file.
+
+    Each row of the file is a timestamp in seconds followed by one column per
+    value attribute (``value0``, ``value1``, ...). A header row is allowed
+    and is skipped. Rows are read one at a time, so the size of the file does
+    not matter.
+
+    Parameters
+    ----------
+        filename
+            The path to a CSV file.
+
+    Yields
+    ------
+        Tuples of the timestamp and a list of values as strings.
+    """
+    with open(filename, newline='') as f:
+        for n, row in enumerate(csv.reader(f)):
+            if not row:
+                continue
+            try:
+                t = float(row[0])
+            except ValueError:
+                if n == 0:
+                    # header row
+                    continue
+                raise
+            yield t, [x.strip() for x in row[1:]]
+
+
+class Replay():
+    """Streams a recorded trace at real or scaled time."""
+    def __init__(self, scheduler: Scheduler, filename: str,
+                 callback: Callable[[List[str]], None], speed: float = 1.0,
+                 loop: bool = False):
+        """
+        Parameters
+        ----------
+        scheduler
+            The scheduler used to pace the samples.
+        filename
+            The trace file, see :func:`read_csv`.
+        callback
+            Function called with the values of each sample when it is due.
+        speed
+            Playback speed, e.g. ``2.0`` plays twice as fast as recorded.
+        loop
+            When ``True``, start over at the end of the trace.
+        """
+        if speed <= 0:
+            raise ValueError('speed must be greater than 0')
+        self._scheduler = scheduler
+        self._filename = filename
+        self._callback = callback
+        self._speed = speed
+        self._loop = loop
+        self._samples = None
+        self._event = None
+        # start() and stop() are called from the control thread while
+        # samples are played on the scheduler thread. The lock is not held
+        # while calling the callback, since that takes other locks.
+        self._lock = threading.RLock()
+
+    def start(self):
+        """Starts the playback from the beginning of the trace."""
+        with self._lock:
+            self.stop()
+            self._samples = read_csv(self._filename)
+            self._start_time = self._scheduler.time()
+            self._first = None
+            self._schedule_next()
+
+    def stop(self):
+        """Stops the playback.
+
+        A sample that is being applied while this is called is still
+        applied, but no more samples are after that.
+        """
+        with self._lock:
+            if self._event:
+                self._scheduler.cancel(self._event)
+                self._event = None
+            if self._samples:
+                self._samples.close()
+                self._samples = None
+
+    @property
+    def running(self) -> bool:
+        """Gets ``True`` while samples remain to be played."""
+        return self._event is not None
+
+    def _schedule_next(self):
+        # must be called with self._lock held
+        samples = self._samples
+        sample = next(samples, None)
+        if sample is None:
+            self._event = None
+            if self._loop and self._first is not None:
+                self.start()
+            return
+
+        t, values = sample
+        if self._first is None:
+            self._first = t
+        when = self._start_time + (t - self._first) / self._speed
+
+        def fire():
+            with self._lock:
+                if self._samples is not samples:
+                    # stopped or started again
+                    return
+            self._callback(values)
+            with self._lock:
+                if self._samples is samples:
+                    self._schedule_next()
+
+        self._event = self._scheduler.call_at(when, fire)
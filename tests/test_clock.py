@@ -0,0 +1,66 @@
+import pytest
+
+from ev3dev.testfs._clock import Clock
+
+
+class FakeTime():
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_clock_run():
+    real = FakeTime()
+    clock = Clock(real)
+    assert clock.time() == 0
+    assert not clock.paused
+
+    real.now += 2
+    assert clock.time() == 2
+
+    clock.run(10)
+    assert clock.speed == 10
+    real.now += 1
+    assert clock.time() == 12
+    assert clock.real_delay(22) == 1
+
+    with pytest.raises(ValueError):
+        clock.run(0)
+
+
+def test_clock_pause():
+    real = FakeTime()
+    clock = Clock(real)
+    real.now += 1
+    clock.pause()
+    assert clock.paused
+    real.now += 1
+    assert clock.time() == 1
+    assert clock.real_delay(2) is None
+
+    clock.advance(0.5)
+    assert clock.time() == 1.5
+    clock.advance_to(1.0)
+    assert clock.time() == 1.5
+    clock.advance_to(3.0)
+    assert clock.time() == 3.0
+
+    with pytest.raises(ValueError):
+        clock.advance(-1)
+
+    clock.run()
+    real.now += 1
+    assert clock.time() == 4.0
+
+
+def test_clock_fast_forward():
+    real = FakeTime()
+    clock = Clock(real)
+    clock.start_fast_forward()
+    assert clock.fast_forward
+    assert not clock.paused
+    assert clock.real_delay(100) == 0
+    real.now += 1
+    assert clock.time() == 0
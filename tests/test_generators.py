@@ -0,0 +1,54 @@
+import pytest
+
+from ev3dev.testfs._generators import ramp, sine, square, noise, Generator
+
+
+def test_ramp():
+    assert ramp(2.0, 0, slope=3, offset=1) == 7
+    assert ramp(2.5, 0, period=2) == 0.5
+
+
+def test_sine():
+    assert sine(0.0, 0, amplitude=10, offset=5) == 5
+    assert sine(0.25, 0, amplitude=10) == pytest.approx(10)
+    assert sine(0.0, 0, amplitude=10, phase=90) == pytest.approx(10)
+
+
+def test_square():
+    assert square(0.1, 0, high=5) == 5
+    assert square(0.6, 0, high=5) == 0
+    assert square(0.6, 0, duty=0.75) == 1
+
+
+def test_noise():
+    a = [noise(0, n, seed=1) for n in range(10)]
+    b = [noise(0, n, seed=1) for n in range(10)]
+    c = [noise(0, n, seed=2) for n in range(10)]
+    assert a == b
+    assert a != c
+
+
+def test_generator_value():
+    g = Generator('ramp', 10, start=100.0, slope=10)
+    assert g.value(100.0) == b'0\n'
+    # value only changes 10 times per second
+    assert g.value(100.19) == b'1\n'
+    assert g.value(101.0) == b'10\n'
+
+    g = Generator('ramp', 10, start=0.0, fmt='{:.1f}')
+    assert g.value(0.25) == b'0.2\n'
+
+
+def test_generator_next_change():
+    g = Generator('sine', 4, start=1.0)
+    assert g.next_change(1.0) == 1.25
+    assert g.next_change(1.3) == 1.5
+
+
+def test_generator_errors():
+    with pytest.raises(ValueError):
+        Generator('triangle', 10, start=0.0)
+    with pytest.raises(ValueError):
+        Generator('ramp', 0, start=0.0)
+    with pytest.raises(TypeError):
+        Generator('ramp', 10, start=0.0, amplitude=1)
@@ -0,0 +1,41 @@
+import threading
+import time
+
+import pytest
+
+from ev3dev.testfs._optrace import Tracer
+
+
+def test_tracer():
+    tracer = Tracer(16)
+    start = time.perf_counter()
+    tracer.add('read', 'fuse', '/file1', start, start + 0.001)
+    tracer.add('GET', 'control', '', start + 0.002, start + 0.003)
+
+    trace = tracer.to_chrome()
+    events = [e for e in trace['traceEvents'] if e['ph'] == 'X']
+    assert [e['name'] for e in events] == ['read', 'GET']
+    assert events[0]['cat'] == 'fuse'
+    assert events[0]['args'] == {'path': '/file1'}
+    assert events[0]['dur'] == pytest.approx(1000)
+    assert events[1]['ts'] - events[0]['ts'] == pytest.approx(2000)
+    assert events[1]['args'] == {}
+    assert events[0]['tid'] == threading.get_ident()
+
+    meta = [e for e in trace['traceEvents'] if e['ph'] == 'M']
+    assert meta[0]['args']['name'] == threading.current_thread().name
+
+
+def test_tracer_ring_buffer():
+    tracer = Tracer(4)
+    for n in range(10):
+        tracer.add(str(n), 'fuse', '', n, n + 0.5)
+
+    events = [e for e in tracer.to_chrome()['traceEvents'] if e['ph'] == 'X']
+    # only the newest events are kept
+    assert [e['name'] for e in events] == ['6', '7', '8', '9']
+
+
+def test_tracer_capacity():
+    with pytest.raises(ValueError):
+        Tracer(0)
@@ -0,0 +1,49 @@
+import threading
+import time
+
+import pytest
+
+from ev3dev.testfs._profiler import SamplingProfiler
+
+
+def busy(stop):
+    while not stop.is_set():
+        sum(range(100))
+
+
+def test_sampling_profiler():
+    stop = threading.Event()
+    worker = threading.Thread(target=busy, args=(stop,), name='worker')
+    worker.start()
+    profiler = SamplingProfiler(0.001)
+    profiler.start()
+    time.sleep(0.1)
+    result = profiler.stop()
+    stop.set()
+    worker.join()
+
+    assert result['interval_ms'] == 1
+    assert result['samples'] > 0
+    assert any(s.startswith('worker;') and 'busy' in s
+               for s in result['stacks'])
+    busy_stats = [f for f in result['functions'] if '(busy)' in f['function']]
+    assert busy_stats[0]['total'] > 0
+
+
+def test_sampling_profiler_idle():
+    stop = threading.Event()
+    waiter = threading.Thread(target=stop.wait, name='waiter')
+    waiter.start()
+    profiler = SamplingProfiler(0.001, [threading.Condition.wait.__code__])
+    profiler.start()
+    time.sleep(0.05)
+    result = profiler.stop()
+    stop.set()
+    waiter.join()
+
+    assert not any(s.startswith('waiter;') for s in result['stacks'])
+
+
+def test_sampling_profiler_interval():
+    with pytest.raises(ValueError):
+        SamplingProfiler(0)
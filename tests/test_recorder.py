@@ -0,0 +1,65 @@
+import os
+import threading
+import time
+
+import pytest
+
+from ev3dev.testfs._recorder import Recorder, loads, HEADER
+
+
+def test_recorder_round_trip():
+    recorder = Recorder('e30=')
+    start = time.perf_counter()
+    recorder.add('getattr', '/file1', (), start)
+    recorder.add('open', '/file1', (os.O_RDWR,), start + 0.001)
+    recorder.add('read', '/file1', (4096, 0, object()), start + 0.002)
+    recorder.add('write', '/file1', (b'a b\n', 2, object()), start + 0.003)
+    recorder.add('truncate', '/file1', (0,), start + 0.004)
+    recorder.add('release', '/file1', (os.O_RDWR, object()), start + 0.005)
+
+    text = recorder.dumps()
+    assert text.startswith(HEADER + '\n')
+
+    tree, records = loads(text)
+    assert tree == 'e30='
+    records = list(records)
+    assert [r[1:] for r in records] == [
+        ('getattr', '/file1', ()),
+        ('open', '/file1', (os.O_RDWR,)),
+        ('read', '/file1', (4096, 0)),
+        ('write', '/file1', (b'a b\n', 2)),
+        ('truncate', '/file1', (0,)),
+        ('release', '/file1', (os.O_RDWR,)),
+    ]
+    for r in records[1:]:
+        assert r[0] == pytest.approx(0.001, abs=2e-6)
+
+
+def test_recorder_spaces():
+    recorder = Recorder('e30=')
+    recorder.add('read', '/dir 1/file 1', (4096, 0), time.perf_counter())
+
+    _, records = loads(recorder.dumps())
+    assert [r[1:] for r in records] == [('read', '/dir 1/file 1', (4096, 0))]
+
+
+def test_recorder_threads():
+    recorder = Recorder('e30=')
+
+    def add():
+        for _ in range(1000):
+            recorder.add('getattr', '/file1', (), time.perf_counter())
+
+    threads = [threading.Thread(target=add) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    _, records = loads(recorder.dumps())
+    assert len(list(records)) == 4000
+
+
+def test_loads_bad_header():
+    with pytest.raises(ValueError):
+        loads('tree e30=\n')
@@ -0,0 +1,48 @@
+import re
+
+import pytest
+
+from ev3dev.testfs._rules import glob_to_regex, Rule, RuleTable
+
+
+def test_glob_to_regex():
+    assert re.match(glob_to_regex('/a/*/c'), '/a/b/c')
+    assert not re.match(glob_to_regex('/a/*/c'), '/a/b/b/c')
+    assert re.match(glob_to_regex('/a/**/c'), '/a/b/b/c')
+    assert re.match(glob_to_regex('/a/b?'), '/a/b1')
+    assert not re.match(glob_to_regex('/a/b?'), '/a/b/')
+    assert not re.match(glob_to_regex('/a.b'), '/a_b')
+    assert not re.match(glob_to_regex('/a'), '/ab')
+
+
+def test_rule():
+    rule = Rule('/motor*/command', 'reset')
+    assert rule.match_path('/motor0/command')
+    assert not rule.match_path('/motor0/position')
+    assert rule.set == {}
+    assert rule.notify == {}
+
+    with pytest.raises(TypeError):
+        Rule('/a', bad=1)
+
+
+def test_rule_table_match():
+    table = RuleTable([
+        {
+            'path': '/motor*/command',
+            'value': 'reset',
+            'set': {'position': '0', '/state': ''},
+            'notify': {'../other/state': 2},
+        },
+        {
+            'path': '/motor*/speed_sp',
+            'set': {'speed': '{value}'},
+        },
+    ])
+
+    assert list(table.match('/motor0/command', b'run-forever\n')) == []
+    assert list(table.match('/motor0/command', b'reset\n')) == [
+        ({'/motor0/position': '0', '/state': ''}, {'/other/state': 2})]
+    assert list(table.match('/motor1/speed_sp', b'100')) == [
+        ({'/motor1/speed': '100'}, {})]
+    assert list(table.match('/motor0/position', b'0')) == []
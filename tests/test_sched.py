@@ -0,0 +1,92 @@
+import time
+
+from ev3dev.testfs._clock import Clock
+from ev3dev.testfs._sched import Scheduler
+
+
+def paused_scheduler():
+    return Scheduler(Clock(speed=0))
+
+
+def test_run_pending_order():
+    scheduler = paused_scheduler()
+    calls = []
+
+    scheduler.call_at(2, lambda: calls.append(2))
+    scheduler.call_at(1, lambda: calls.append(1))
+    scheduler.call_later(3, lambda: calls.append(3))
+
+    scheduler.run_pending()
+    assert calls == []
+
+    scheduler.clock.advance_to(2)
+    scheduler.run_pending()
+    assert calls == [1, 2]
+
+    scheduler.clock.advance_to(10)
+    scheduler.run_pending()
+    assert calls == [1, 2, 3]
+
+
+def test_cancel():
+    scheduler = paused_scheduler()
+    calls = []
+
+    event = scheduler.call_at(1, lambda: calls.append(1))
+    scheduler.cancel(event)
+    scheduler.clock.advance_to(1)
+    scheduler.run_pending()
+    assert calls == []
+
+    # cancelling again is harmless
+    scheduler.cancel(event)
+
+
+def test_callback_error(capsys):
+    scheduler = paused_scheduler()
+    calls = []
+
+    scheduler.call_at(0, lambda: 1 / 0)
+    scheduler.call_at(0, lambda: calls.append(1))
+    scheduler.run_pending()
+    assert calls == [1]
+
+    captured = capsys.readouterr()
+    assert captured.out == ''
+    assert 'ZeroDivisionError' in captured.err
+
+
+def test_step():
+    scheduler = paused_scheduler()
+    calls = []
+
+    def tick():
+        calls.append(scheduler.time())
+        scheduler.call_later(0.25, tick)
+
+    scheduler.call_at(0, tick)
+    scheduler.step(1.0)
+    # each callback runs at the exact time it was scheduled for
+    assert calls == [0, 0.25, 0.5, 0.75, 1.0]
+    assert scheduler.time() == 1.0
+
+
+def test_fast_forward():
+    scheduler = paused_scheduler()
+    scheduler.start()
+    calls = []
+
+    def tick():
+        calls.append(scheduler.time())
+        if len(calls) < 100:
+            scheduler.call_later(60, tick)
+
+    scheduler.call_at(0, tick)
+    scheduler.clock.start_fast_forward()
+    scheduler.wake()
+    # 99 minutes of virtual time should pass in much less than a second
+    for _ in range(100):
+        if len(calls) == 100:
+            break
+        time.sleep(0.01)
+    assert calls == [60 * n for n in range(100)]
@@ -0,0 +1,43 @@
+from ev3dev.testfs._stats import Histogram, Stats
+
+
+def test_histogram():
+    h = Histogram()
+    assert h.percentile(50) == 0
+
+    for ns in (1000, 1000, 1000, 5000):
+        h.add(ns)
+    assert h.count == 4
+    assert h.total_ns == 8000
+    assert h.max_ns == 5000
+    # 1000 is in the bucket that ends at 1024
+    assert h.percentile(50) == 1024
+    # but the estimate is never more than the maximum
+    assert h.percentile(99) == 5000
+
+    d = h.to_dict()
+    assert d['count'] == 4
+    assert d['mean_us'] == 2
+    assert d['max_us'] == 5
+    assert d['histogram'] == [[1.024, 3], [8.192, 1]]
+
+
+def test_histogram_overflow():
+    h = Histogram()
+    h.add(2 ** 60)
+    assert h.count == 1
+    assert h.buckets[-1] == 1
+
+
+def test_stats():
+    stats = Stats()
+    assert stats.to_dict() == {}
+
+    stats.record('read', 0.000001)
+    stats.record('read', 0.000002)
+    stats.record('GET', 0.001)
+
+    d = stats.to_dict(reset=True)
+    assert d['read']['count'] == 2
+    assert d['GET']['count'] == 1
+    assert stats.to_dict() == {}
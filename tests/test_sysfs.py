@@ -1,11 +1,19 @@
 import copy
 import errno
+import hashlib
 import os
+import re
+import select
 import stat
+import threading
+import time
 
-from ev3dev.testfs import encode_bytes, decode_bytes
+from pathlib import Path
+
+from ev3dev.testfs import encode_bytes, decode_bytes, _apply_changes
+from ev3dev.testfs._recorder import loads
 from ev3dev.testfs._sysfs import SysfsFuse
-from ev3dev.testfs._util import decode_dict
+from ev3dev.testfs._util import encode_dict, decode_dict
 
 ALL_BYTES = bytes(range(256))
 
@@ -49,6 +57,29 @@ def test_parse_line_GET():
     assert decode_dict(split[1]) == SMALL_DICT
 
 
+def test_parse_line_GET_path():
+    sysfs = SysfsFuse()
+    sysfs._root = copy.deepcopy(TEST_ROOT)
+
+    reply = sysfs._parse_line('GET /dir1')
+    assert decode_dict(reply.split()[1]) == TEST_ROOT['contents'][0]
+
+    reply = sysfs._parse_line('GET /dir1 1')
+    dir1 = decode_dict(reply.split()[1])
+    assert [x['name'] for x in dir1['contents']] == ['dir2']
+    assert 'contents' not in dir1['contents'][0]
+
+    reply = sysfs._parse_line('GET / 0')
+    root = decode_dict(reply.split()[1])
+    assert 'contents' not in root
+    assert sysfs._root == TEST_ROOT
+
+    reply = sysfs._parse_line('GET /file1 0')
+    assert decode_dict(reply.split()[1]) == TEST_ROOT['contents'][1]
+
+    assert sysfs._parse_line('GET /file2').startswith('ERR ')
+
+
 def test_parse_line_SET():
     SMALL_DICT = {'key': 'value'}
     sysfs = SysfsFuse()
@@ -59,6 +90,80 @@ def test_parse_line_SET():
     assert sysfs._root == SMALL_DICT
 
 
+def test_generation():
+    sysfs = SysfsFuse()
+    sysfs._root = copy.deepcopy(TEST_ROOT)
+
+    def changes(line):
+        before = sysfs._generation
+        assert sysfs._parse_line(line).split()[0] == 'OK'
+        return sysfs._generation > before
+
+    assert changes('SET ' + encode_dict(TEST_ROOT))
+    assert changes('NOTIFY /file1 1')
+    assert changes('PUT /file1')
+    assert changes('PUT /dir1/file2')
+    assert changes('DELETE /dir1/file2')
+    assert not changes('READ /file1')
+    assert not changes('EXISTS /file1')
+
+    before = sysfs._generation
+    sysfs.write('/file1', b'test', 0)
+    assert sysfs._generation > before
+
+
+def test_parse_line_CHANGES():
+    sysfs = SysfsFuse()
+    sysfs._root = copy.deepcopy(TEST_ROOT)
+    sysfs._root['contents'].append({
+        'name': 'link1',
+        'type': 'link',
+        'mode': 0o777,
+        'target': 'dir1',
+    })
+
+    reply = sysfs._parse_line('CHANGES -1')
+    ok, generation, kind, tree = reply.split()
+    assert (ok, kind) == ('OK', 'tree')
+    tree = decode_dict(tree)
+    assert tree == sysfs._root
+    assert sysfs._parse_line('CHANGES ' + generation).split() == ['OK']
+
+    sysfs._parse_line('PUT /link1/dir2/file2 ' + encode_bytes(b'a'))
+    sysfs._parse_line('PUT /link1/dir2/file2 ' + encode_bytes(b'b'))
+    sysfs._parse_line('NOTIFY /file1 1')
+    sysfs._parse_line('PUT /dir1/file3')
+    sysfs._parse_line('DELETE /dir1/file3')
+    sysfs.write('/file1', b'test', 0)
+
+    reply = sysfs._parse_line('CHANGES ' + generation)
+    ok, generation, kind, changes = reply.split()
+    assert (ok, kind) == ('OK', 'changes')
+    assert int(generation) == sysfs._generation
+    changes = decode_dict(changes)['changes']
+    # paths are without links and each one is sent once
+    paths = [c[1] for c in changes]
+    assert paths == ['/dir1/dir2', '/dir1/dir2/file2', '/file1', '/dir1',
+                     '/dir1/file3']
+    assert changes[0][0] == 'attrs'
+    assert changes[-1] == ['delete', '/dir1/file3']
+
+    assert _apply_changes(tree, changes) == sysfs._root
+
+    # too old
+    sysfs._parse_line('NOTIFY /file1 1')
+    sysfs._changes.clear()
+    sysfs._parse_line('NOTIFY /file1 1')
+    reply = sysfs._parse_line('CHANGES ' + generation)
+    assert reply.split()[2] == 'tree'
+
+    # replaced
+    generation = str(sysfs._generation)
+    sysfs._parse_line('SET ' + encode_dict(TEST_ROOT))
+    reply = sysfs._parse_line('CHANGES ' + generation)
+    assert reply.split()[2] == 'tree'
+
+
 def test_parse_line_NOTIFY():
     sysfs = SysfsFuse()
     sysfs._root = copy.deepcopy(TEST_ROOT)
@@ -70,6 +175,748 @@ def test_parse_line_NOTIFY():
     assert file1['poll_events'] == 1
 
 
+def test_parse_line_READ():
+    sysfs = SysfsFuse()
+    sysfs._root = copy.deepcopy(TEST_ROOT)
+
+    reply = sysfs._parse_line('READ /file1')
+    assert reply.split() == ['OK', encode_bytes(ALL_BYTES)]
+
+    assert sysfs._parse_line('READ /dir1').startswith('ERR ')
+    assert sysfs._parse_line('READ /file2').startswith('ERR ')
+
+
+def test_parse_line_MGET():
+    sysfs = SysfsFuse()
+    sysfs._root = copy.deepcopy(TEST_ROOT)
+
+    reply = sysfs._parse_line('MGET /file1 /file1')
+    assert decode_dict(reply.split()[1]) == {
+        'values': [encode_bytes(ALL_BYTES)] * 2}
+
+    assert sysfs._parse_line('MGET /file1 /dir1').startswith('ERR ')
+
+
+def test_parse_line_MSET():
+    sysfs = SysfsFuse()
+    sysfs._root = copy.deepcopy(TEST_ROOT)
+    sysfs._parse_line('PUT /dir1/file2')
+
+    values = {'/file1': encode_bytes(b'1'), '/dir1/file2': encode_bytes(b'2')}
+    reply = sysfs._parse_line('MSET ' + encode_dict(values))
+    assert reply.split() == ['OK']
+    assert sysfs.read('/file1', 4096, 0) == b'1'
+    assert sysfs.read('/dir1/file2', 4096, 0) == b'2'
+
+    # nothing is changed when a path is not valid
+    values = {'/file1': encode_bytes(b'3'), '/file3': encode_bytes(b'3')}
+    reply = sysfs._parse_line('MSET ' + encode_dict(values))
+    assert reply.startswith('ERR ')
+    assert sysfs.read('/file1', 4096, 0) == b'1'
+
+
+def test_parse_line_MGET_MSET_snapshot():
+    # MSET copies nodes shared with a snapshot, which MGET must not miss
+    sysfs = SysfsFuse()
+    sysfs._root = copy.deepcopy(TEST_ROOT)
+    sysfs._parse_line('PUT /dir1/file2')
+    stop = False
+
+    def mset():
+        n = 0
+        while not stop:
+            sysfs._parse_line('SNAPSHOT SAVE s1')
+            value = encode_bytes(b'%d' % n)
+            sysfs._parse_line('MSET ' + encode_dict({
+                '/file1': value, '/dir1/file2': value}))
+            n += 1
+
+    thread = threading.Thread(target=mset)
+    thread.start()
+    try:
+        for _ in range(2000):
+            reply = sysfs._parse_line('MGET /file1 /dir1/file2')
+            values = decode_dict(reply.split()[1])['values']
+            assert values[0] == values[1]
+    finally:
+        stop = True
+        thread.join()
+
+
+def test_parse_line_SNAPSHOT():
+    sysfs = SysfsFuse()
+    sysfs._root = copy.deepcopy(TEST_ROOT)
+    dir2 = sysfs._get_item('/dir1/dir2')
+
+    reply = sysfs._parse_line('SNAPSHOT SAVE s1')
+    assert reply.split() == ['OK']
+    saved = copy.deepcopy(sysfs._root)
+
+    sysfs.write('/file1', b'test', 0)
+    sysfs._parse_line('NOTIFY /file1 1')
+    sysfs._parse_line('PUT /dir1/dir2/file2')
+    sysfs._parse_line('DELETE /dir1')
+    assert sysfs._get_item('/file1')['poll_events'] == 1
+    # the snapshot is not changed
+    assert sysfs._snapshots['s1'] == saved
+
+    generation = sysfs._generation
+    reply = sysfs._parse_line('SNAPSHOT RESTORE s1')
+    assert reply.split() == ['OK']
+    assert sysfs._root == saved
+    # nodes that were not changed are shared with the snapshot
+    assert sysfs._get_item('/dir1/dir2') is dir2
+
+    # only the changed nodes are reported to clients
+    reply = sysfs._parse_line('CHANGES {}'.format(generation))
+    changes = decode_dict(reply.split()[3])['changes']
+    assert sorted(c[1] for c in changes) == ['/', '/dir1', '/file1']
+
+    # the snapshot can be restored again
+    sysfs._parse_line('PUT /file1')
+    sysfs._parse_line('SNAPSHOT RESTORE s1')
+    assert sysfs._root == saved
+
+    reply = sysfs._parse_line('SNAPSHOT DROP s1')
+    assert reply.split() == ['OK']
+    assert sysfs._parse_line('SNAPSHOT RESTORE s1').startswith('ERR ')
+    assert sysfs._parse_line('SNAPSHOT DROP s1').startswith('ERR ')
+    assert sysfs._parse_line('SNAPSHOT COPY s1').startswith('ERR ')
+
+
+def test_parse_line_BASE():
+    sysfs = SysfsFuse()
+    assert sysfs._parse_line('BASE RESET').startswith('ERR ')
+    assert sysfs._parse_line('BASE USE 1234').split() == ['OK', '0']
+
+    tree = encode_dict(TEST_ROOT)
+    reply = sysfs._parse_line('BASE SET ' + tree)
+    assert reply.split() == ['OK', hashlib.sha1(tree.encode()).hexdigest()]
+    digest = reply.split()[1]
+    assert sysfs._root == TEST_ROOT
+
+    sysfs.write('/file1', b'test', 0)
+    sysfs._parse_line('PUT /dir1/file2')
+    sysfs._callback_counts['/file1'] = 1
+    assert sysfs._get_item('/file1')['write_data'] == encode_bytes(b'test')
+    # the changes are in the overlay, the base is not changed
+    assert sysfs._base == TEST_ROOT
+
+    # a notification from a generator that is due after the reset
+    sysfs._parse_line('CLOCK PAUSE')
+    decl = {'kind': 'sine', 'rate': 10, 'notify': True}
+    sysfs._parse_line('GENERATOR SET /file1 ' + encode_dict(decl))
+    sysfs.poll('/file1', object())
+    assert '/file1' in sysfs._generator_events
+
+    reply = sysfs._parse_line('BASE RESET')
+    assert reply.split() == ['OK']
+    assert sysfs._root == TEST_ROOT
+    assert not sysfs._callback_counts
+    assert not sysfs._generator_events
+    assert not sysfs._generators
+    sysfs._parse_line('CLOCK STEP 1000')
+    assert sysfs._root == TEST_ROOT
+
+    sysfs._parse_line('PUT /dir1/file2')
+    reply = sysfs._parse_line('BASE USE 1234')
+    assert reply.split() == ['OK', '0']
+    assert sysfs._get_item('/dir1/file2')
+    reply = sysfs._parse_line('BASE USE ' + digest)
+    assert reply.split() == ['OK', '1']
+    assert sysfs._root == TEST_ROOT
+
+    assert sysfs._parse_line('BASE DROP').startswith('ERR ')
+
+
+def test_parse_line_PUT():
+    sysfs = SysfsFuse()
+    sysfs._root = copy.deepcopy(TEST_ROOT)
+
+    reply = sysfs._parse_line('PUT /file1 ' + encode_bytes(b'test'))
+    assert reply.split() == ['OK']
+    assert sysfs._get_item('/file1')['contents'] == encode_bytes(b'test')
+
+    reply = sysfs._parse_line('PUT /dir1/file2')
+    assert reply.split() == ['OK']
+    file2 = sysfs._get_item('/dir1/file2')
+    assert file2['type'] == 'file'
+    assert file2['contents'] == ''
+
+    assert sysfs._parse_line('PUT /dir1 dGVzdA==').startswith('ERR ')
+    assert sysfs._parse_line('PUT /dir3/file3 dGVzdA==').startswith('ERR ')
+    assert sysfs._parse_line('PUT /file1 A').startswith('ERR ')
+
+
+def test_parse_line_DELETE():
+    sysfs = SysfsFuse()
+    sysfs._root = copy.deepcopy(TEST_ROOT)
+
+    reply = sysfs._parse_line('DELETE /dir1/dir2')
+    assert reply.split() == ['OK']
+    assert sysfs._get_item('/dir1/dir2') is None
+
+    assert sysfs._parse_line('DELETE /dir1/dir2').startswith('ERR ')
+
+
+def test_parse_line_EXISTS():
+    sysfs = SysfsFuse()
+    sysfs._root = copy.deepcopy(TEST_ROOT)
+
+    assert sysfs._parse_line('EXISTS /dir1/dir2').split() == ['OK', '1']
+    assert sysfs._parse_line('EXISTS /file1').split() == ['OK', '1']
+    assert sysfs._parse_line('EXISTS /file2').split() == ['OK', '0']
+
+
+def test_parse_line_WAIT():
+    sysfs = SysfsFuse()
+    sysfs._root = copy.deepcopy(TEST_ROOT)
+
+    reply = sysfs._parse_line('WAIT /file1 0.01')
+    assert reply.split() == ['OK']
+
+    def write():
+        time.sleep(0.05)
+        sysfs.write('/file1', b'stop\n', 0)
+        sysfs.write('/file1', b'run-forever\n', 0)
+
+    thread = threading.Thread(target=write)
+    thread.start()
+    pattern = encode_bytes(b'run-.*')
+    reply = sysfs._parse_line('WAIT /file1 5 {} {}'.format(
+        pattern, int(re.DOTALL)))
+    thread.join()
+    assert reply.split()[0] == 'OK'
+    data = decode_dict(reply.split()[1])['data']
+    assert decode_bytes(data) == b'run-forever\n'
+    assert sysfs._waiters == []
+
+    assert sysfs._parse_line('WAIT /dir1 0.01').startswith('ERR ')
+
+
+def test_reply(capsys):
+    sysfs = SysfsFuse()
+    sysfs._root = copy.deepcopy(TEST_ROOT)
+
+    sysfs._reply('#7', 'EXISTS /file1')
+    sysfs._reply('', 'EXISTS /file2')
+    assert capsys.readouterr().out == '#7 OK 1\nOK 0\n'
+
+
+def test_parse_line_REPLAY(tmp_path: Path):
+    trace = tmp_path.joinpath('trace.csv')
+    trace.write_text('0,5\n')
+    sysfs = SysfsFuse()
+    sysfs._root = copy.deepcopy(TEST_ROOT)
+    sysfs._root['contents'][0]['contents'].append({
+        'name': 'value0',
+        'type': 'file',
+        'mode': 0o444,
+        'contents': '',
+    })
+
+    params = {'path': '/dir0', 'filename': str(trace)}
+    reply = sysfs._parse_line('REPLAY START {}'.format(encode_dict(params)))
+    assert reply.startswith('ERR ')
+
+    params = {'path': '/dir1', 'filename': str(trace)}
+    reply = sysfs._parse_line('REPLAY START {}'.format(encode_dict(params)))
+    assert reply.split() == ['OK']
+    assert '/dir1' in sysfs._replays
+
+    sysfs._scheduler.run_pending()
+    value0 = sysfs._get_item('/dir1/value0')
+    assert decode_bytes(value0['contents']) == b'5\n'
+    assert value0['poll_events'] == select.POLLPRI
+
+    reply = sysfs._parse_line('REPLAY STOP /dir1')
+    assert reply.split() == ['OK']
+    assert '/dir1' not in sysfs._replays
+
+
+def test_parse_line_GENERATOR():
+    sysfs = SysfsFuse()
+    sysfs._root = copy.deepcopy(TEST_ROOT)
+    decl = {'kind': 'ramp', 'rate': 10, 'params': {'slope': 10}}
+
+    reply = sysfs._parse_line('GENERATOR SET /dir1 {}'.format(
+        encode_dict(decl)))
+    assert reply.startswith('ERR ')
+
+    reply = sysfs._parse_line('GENERATOR SET /file1 {}'.format(
+        encode_dict({'kind': 'bad', 'rate': 10})))
+    assert reply.startswith('ERR ')
+    file1 = sysfs._root['contents'][1]
+    assert 'generator' not in file1
+
+    reply = sysfs._parse_line('GENERATOR SET /file1 {}'.format(
+        encode_dict(decl)))
+    assert reply.split() == ['OK']
+    file1 = sysfs._root['contents'][1]
+    assert file1['generator']['kind'] == 'ramp'
+
+    # a bad declaration leaves the current one in place
+    reply = sysfs._parse_line('GENERATOR SET /file1 {}'.format(
+        encode_dict({'kind': 'ramp'})))
+    assert reply.startswith('ERR ')
+    assert sysfs._root['contents'][1]['generator']['kind'] == 'ramp'
+    assert sysfs._parse_line('READ /file1').split()[0] == 'OK'
+
+    reply = sysfs._parse_line('GENERATOR CLEAR /file1')
+    assert reply.split() == ['OK']
+    assert 'generator' not in file1
+
+
+def test_read_generator():
+    sysfs = SysfsFuse()
+    sysfs._root = copy.deepcopy(TEST_ROOT)
+    file1 = sysfs._root['contents'][1]
+    file1['generator'] = {
+        'kind': 'ramp',
+        'rate': 10,
+        'params': {'slope': 10},
+        'start': sysfs._scheduler.time() - 1.0,
+    }
+
+    ret = sysfs.read('/file1', 4096, 0)
+    assert int(ret) >= 10
+    assert ret.endswith(b'\n')
+
+
+def test_poll_generator():
+    sysfs = SysfsFuse()
+    sysfs._root = copy.deepcopy(TEST_ROOT)
+    file1 = sysfs._root['contents'][1]
+    file1['generator'] = {'kind': 'sine', 'rate': 1000, 'notify': True}
+    poll_handle = object()
+    notified = []
+    sysfs.NotifyPoll = notified.append
+
+    ret = sysfs.poll('/file1', poll_handle)
+    assert ret == 0
+    assert '/file1' in sysfs._generator_events
+
+    # a second poll does not schedule another notification
+    event = sysfs._generator_events['/file1']
+    sysfs.poll('/file1', poll_handle)
+    assert sysfs._generator_events['/file1'] is event
+
+    while '/file1' in sysfs._generator_events:
+        sysfs._scheduler.run_pending()
+    assert notified == [poll_handle]
+    assert file1['poll_events'] == select.POLLPRI
+
+
+def _plugin(path, node, time):
+    return path.encode()
+
+
+def test_parse_line_CALLBACK():
+    sysfs = SysfsFuse()
+    sysfs._root = copy.deepcopy(TEST_ROOT)
+
+    reply = sysfs._parse_line('CALLBACK REGISTER c1 {}'.format(
+        encode_dict({'expression': 'count'})))
+    assert reply.split() == ['OK']
+    assert 'c1' in sysfs._callbacks
+
+    reply = sysfs._parse_line('CALLBACK REGISTER c2 {}'.format(
+        encode_dict({})))
+    assert reply.startswith('ERR ')
+
+    reply = sysfs._parse_line('CALLBACK SET /file1 c2')
+    assert reply.startswith('ERR ')
+    reply = sysfs._parse_line('CALLBACK SET /dir1 c1')
+    assert reply.startswith('ERR ')
+
+    reply = sysfs._parse_line('CALLBACK SET /file1 c1')
+    assert reply.split() == ['OK']
+    file1 = sysfs._root['contents'][1]
+    assert file1['callback'] == 'c1'
+
+    reply = sysfs._parse_line('CALLBACK CLEAR /file1')
+    assert reply.split() == ['OK']
+    assert 'callback' not in file1
+
+
+def test_read_callback():
+    sysfs = SysfsFuse()
+    sysfs._root = copy.deepcopy(TEST_ROOT)
+    sysfs._parse_line('CALLBACK REGISTER count {}'.format(
+        encode_dict({'expression': 'count * 1000'})))
+    sysfs._parse_line('CALLBACK REGISTER plugin {}'.format(
+        encode_dict({'plugin': 'test_sysfs:_plugin'})))
+    sysfs._parse_line('CALLBACK REGISTER error {}'.format(
+        encode_dict({'expression': '1 / 0'})))
+    file1 = sysfs._root['contents'][1]
+
+    file1['callback'] = 'count'
+    fh = sysfs.open('/file1', os.O_RDONLY)
+    assert fh is not None
+    assert sysfs.read('/file1', 4096, 0, fh) == b'0\n'
+    # reading the rest of the file uses the cached value
+    assert sysfs.read('/file1', 4096, 1, fh) == b'\n'
+    # reading from the start again computes a new value
+    assert sysfs.read('/file1', 4096, 0, fh) == b'1000\n'
+    sysfs.release('/file1', os.O_RDONLY, fh)
+
+    file1['callback'] = 'plugin'
+    assert sysfs.read('/file1', 4096, 0) == b'/file1'
+
+    file1['callback'] = 'error'
+    assert sysfs.read('/file1', 4096, 0) == -errno.EIO
+
+
+def test_parse_line_CLOCK():
+    sysfs = SysfsFuse()
+    sysfs._root = copy.deepcopy(TEST_ROOT)
+    calls = []
+
+    reply = sysfs._parse_line('CLOCK PAUSE')
+    assert reply.split() == ['OK']
+    assert sysfs._scheduler.clock.paused
+
+    start = float(sysfs._parse_line('CLOCK TIME').split()[1])
+    sysfs._scheduler.call_at(start + 0.1, lambda: calls.append(1))
+    reply = sysfs._parse_line('CLOCK STEP 250')
+    assert reply.split() == ['OK']
+    assert calls == [1]
+    reply = sysfs._parse_line('CLOCK TIME')
+    assert float(reply.split()[1]) == start + 0.25
+
+    reply = sysfs._parse_line('CLOCK RUN 2.5')
+    assert reply.split() == ['OK']
+    assert sysfs._scheduler.clock.speed == 2.5
+
+    reply = sysfs._parse_line('CLOCK FAST')
+    assert reply.split() == ['OK']
+    assert sysfs._scheduler.clock.fast_forward
+
+    reply = sysfs._parse_line('CLOCK RUN 0')
+    assert reply.startswith('ERR ')
+    reply = sysfs._parse_line('CLOCK BACKWARDS')
+    assert reply.startswith('ERR ')
+
+
+def test_parse_line_HOTPLUG():
+    sysfs = SysfsFuse()
+    sysfs._root = copy.deepcopy(TEST_ROOT)
+    device = {
+        'type': 'directory',
+        'mode': 0o755,
+        'contents': [
+            {'name': 'value0', 'type': 'file', 'mode': 0o444, 'contents': ''},
+        ],
+    }
+    params = {'path': '/dir1/dev0', 'node': device, 'link': '/dir1/dir2/l0'}
+    poll_handle = object()
+    notified = []
+    sysfs.NotifyPoll = notified.append
+
+    reply = sysfs._parse_line('HOTPLUG ADD {}'.format(encode_dict(params)))
+    assert reply.split() == ['OK']
+    dir1 = sysfs._root['contents'][0]
+    assert dir1['mtime'] > 0
+    assert sysfs._get_item('/dir1/dev0')['name'] == 'dev0'
+    assert sysfs._get_item('/dir1/dir2/l0')['target'] == '../dev0'
+    assert sysfs.readlink('/dir1/dir2/l0') == '../dev0'
+    assert sysfs._get_item('/dir1/dir2/l0/value0')['name'] == 'value0'
+
+    # can't add the same device twice
+    reply = sysfs._parse_line('HOTPLUG ADD {}'.format(encode_dict(params)))
+    assert reply.startswith('ERR ')
+
+    sysfs.poll('/dir1/dev0/value0', poll_handle)
+    del params['node']
+    reply = sysfs._parse_line('HOTPLUG REMOVE {}'.format(encode_dict(params)))
+    assert reply.split() == ['OK']
+    assert sysfs._get_item('/dir1/dev0') is None
+    assert sysfs._get_item('/dir1/dir2/l0') is None
+    assert notified == [poll_handle]
+    assert sysfs._poll_handles == {}
+
+    reply = sysfs._parse_line('HOTPLUG REMOVE {}'.format(encode_dict(params)))
+    assert reply.startswith('ERR ')
+
+
+def test_parse_line_HOTPLUG_atomic():
+    sysfs = SysfsFuse()
+    sysfs._root = copy.deepcopy(TEST_ROOT)
+    device = {'type': 'directory', 'mode': 0o755, 'contents': []}
+
+    def hotplug(subcommand, **params):
+        before = copy.deepcopy(sysfs._root)
+        reply = sysfs._parse_line('HOTPLUG {} {}'.format(
+            subcommand, encode_dict(params)))
+        assert reply.startswith('ERR ')
+        # nothing is changed when one of the paths is not valid
+        assert sysfs._root == before
+
+    hotplug('ADD', path='/dir1/dev0', node=device, link='/dir3/l0')
+    hotplug('ADD', path='/dir3/dev0', node=device, link='/dir1/l0')
+    hotplug('ADD', path='/dir1/dev0', node=device, link='/dir1/dev0')
+
+    params = {'path': '/dir1/dev0', 'node': device, 'link': '/dir1/dir2/l0'}
+    sysfs._parse_line('HOTPLUG ADD {}'.format(encode_dict(params)))
+    hotplug('REMOVE', path='/dir1/dev1', link='/dir1/dir2/l0')
+    hotplug('REMOVE', path='/dir1/dev0', link='/dir1/dir2/l1')
+
+
+TEMPLATE = {
+    'type': 'directory',
+    'mode': 0o755,
+    'contents': [
+        {
+            'name': 'address',
+            'type': 'file',
+            'mode': 0o444,
+            'contents': encode_bytes(b'{address}\n'),
+        },
+        {
+            'name': 'sub{n}',
+            'type': 'directory',
+            'mode': 0o755,
+            'contents': [],
+        },
+    ],
+}
+
+
+def test_parse_line_TEMPLATE():
+    sysfs = SysfsFuse()
+
+    reply = sysfs._parse_line('TEMPLATE t1 {}'.format(encode_dict(TEMPLATE)))
+    assert reply.split() == ['OK']
+    assert sysfs._templates['t1'] == TEMPLATE
+
+    reply = sysfs._parse_line('TEMPLATE t2 {}'.format(
+        encode_dict({'type': 'file'})))
+    assert reply.startswith('ERR ')
+
+
+def test_lazy_directory():
+    sysfs = SysfsFuse()
+    sysfs._root = copy.deepcopy(TEST_ROOT)
+    sysfs._templates['t1'] = TEMPLATE
+    lazy = {
+        'name': 'lazy',
+        'type': 'directory',
+        'mode': 0o755,
+        'lazy': {'template': 't1', 'params': {'address': 'in1', 'n': 2}},
+    }
+    sysfs._root['contents'].append(lazy)
+
+    # stat does not expand the directory
+    attr = sysfs.getattr('/lazy')
+    assert stat.S_IFMT(attr.st_mode) == stat.S_IFDIR
+    assert 'lazy' in lazy
+
+    names = [x.name for x in sysfs.readdir('/lazy', 0)]
+    assert names == ['.', '..', 'address', 'sub2']
+    assert 'lazy' not in lazy
+    assert sysfs.read('/lazy/address', 4096, 0) == b'in1\n'
+    # template is not modified
+    assert TEMPLATE['contents'][1]['name'] == 'sub{n}'
+
+
+def test_lazy_directory_binary_file():
+    sysfs = SysfsFuse()
+    sysfs._root = copy.deepcopy(TEST_ROOT)
+    sysfs._templates['t1'] = {
+        'type': 'directory',
+        'mode': 0o755,
+        'contents': [
+            {
+                'name': 'raw',
+                'type': 'file',
+                'mode': 0o444,
+                'contents': encode_bytes(b'\xff{n}\x00'),
+            },
+        ],
+    }
+    sysfs._root['contents'].append({
+        'name': 'lazy',
+        'type': 'directory',
+        'mode': 0o755,
+        'lazy': {'template': 't1', 'params': {'n': 2}},
+    })
+
+    # contents that are not UTF-8 are filled in too
+    assert sysfs.read('/lazy/raw', 4096, 0) == b'\xff2\x00'
+
+
+def test_lazy_directory_lookup():
+    sysfs = SysfsFuse()
+    sysfs._root = copy.deepcopy(TEST_ROOT)
+    sysfs._templates['t1'] = TEMPLATE
+    sysfs._root['contents'].append({
+        'name': 'lazy',
+        'type': 'directory',
+        'mode': 0o755,
+        'lazy': {'template': 't1'},
+    })
+
+    assert sysfs._get_item('/lazy/sub{n}')['type'] == 'directory'
+    assert sysfs.read('/lazy/address', 4096, 0) == b'{address}\n'
+
+
+def test_lazy_directory_unknown_template(capsys):
+    sysfs = SysfsFuse()
+    sysfs._root = copy.deepcopy(TEST_ROOT)
+    sysfs._root['contents'].append({
+        'name': 'lazy',
+        'type': 'directory',
+        'mode': 0o755,
+        'lazy': {'template': 't1'},
+    })
+
+    assert sysfs.readdir('/lazy', 0) == -errno.ENOENT
+    assert sysfs.getattr('/lazy/address') == -errno.ENOENT
+    assert 'Unknown template: t1' in capsys.readouterr().err
+    assert sysfs._parse_line('READ /lazy/address').startswith('ERR ')
+
+    # it works once the template is registered
+    sysfs._parse_line('TEMPLATE t1 {}'.format(encode_dict(TEMPLATE)))
+    assert sysfs.read('/lazy/address', 4096, 0) == b'{address}\n'
+
+
+def test_parse_line_STATS():
+    sysfs = SysfsFuse()
+    sysfs._root = copy.deepcopy(TEST_ROOT)
+
+    sysfs.getattr('/file1')
+    sysfs.read('/file1', 4096, 0)
+    sysfs._parse_line('GET')
+
+    reply = sysfs._parse_line('STATS')
+    assert reply.split()[0] == 'OK'
+    stats = decode_dict(reply.split()[1])
+    assert stats['getattr']['count'] == 1
+    assert stats['read']['count'] == 1
+    assert stats['lookup']['count'] == 2
+    assert stats['GET']['count'] == 1
+
+    reply = sysfs._parse_line('STATS RESET')
+    stats = decode_dict(reply.split()[1])
+    # includes the previous STATS command
+    assert stats['STATS']['count'] == 1
+
+    reply = sysfs._parse_line('STATS')
+    stats = decode_dict(reply.split()[1])
+    assert list(stats) == ['STATS']
+
+
+def test_parse_line_TRACING():
+    sysfs = SysfsFuse()
+    sysfs._root = copy.deepcopy(TEST_ROOT)
+
+    reply = sysfs._parse_line('TRACING DUMP')
+    assert reply.startswith('ERR ')
+
+    reply = sysfs._parse_line('TRACING START 100')
+    assert reply.split() == ['OK']
+    assert sysfs._scheduler.tracer is sysfs._tracer
+
+    sysfs.getattr('/file1')
+    sysfs._parse_line('NOTIFY /file1 1')
+
+    reply = sysfs._parse_line('TRACING DUMP')
+    assert reply.split()[0] == 'OK'
+    trace = decode_dict(reply.split()[1])
+    events = [(e['name'], e['cat'], e['args'].get('path'))
+              for e in trace['traceEvents'] if e['ph'] == 'X']
+    assert events == [
+        ('TRACING', 'control', None),
+        # events are sorted by start time, so nested events come after
+        ('getattr', 'fuse', '/file1'),
+        ('lookup', 'lookup', '/file1'),
+        ('NOTIFY', 'control', '/file1'),
+        ('lookup', 'lookup', '/file1'),
+    ]
+
+    reply = sysfs._parse_line('TRACING STOP')
+    assert reply.split() == ['OK']
+    assert sysfs._tracer is None
+    assert sysfs._scheduler.tracer is None
+
+
+def test_parse_line_PROFILE():
+    sysfs = SysfsFuse()
+    sysfs._root = copy.deepcopy(TEST_ROOT)
+
+    reply = sysfs._parse_line('PROFILE STOP')
+    assert reply.startswith('ERR ')
+
+    reply = sysfs._parse_line('PROFILE START 0.5')
+    assert reply.split() == ['OK']
+    reply = sysfs._parse_line('PROFILE START')
+    assert reply.startswith('ERR ')
+
+    for _ in range(1000):
+        sysfs.getattr('/dir1/dir2')
+
+    reply = sysfs._parse_line('PROFILE STOP')
+    assert reply.split()[0] == 'OK'
+    result = decode_dict(reply.split()[1])
+    assert result['interval_ms'] == 0.5
+    assert 'functions' in result
+    assert 'stacks' in result
+    assert sysfs._profiler is None
+
+
+def test_parse_line_RECORD():
+    sysfs = SysfsFuse()
+    sysfs._root = copy.deepcopy(TEST_ROOT)
+
+    reply = sysfs._parse_line('RECORD STOP')
+    assert reply.startswith('ERR ')
+
+    reply = sysfs._parse_line('RECORD START')
+    assert reply.split() == ['OK']
+
+    sysfs.getattr('/file1')
+    sysfs.read('/file1', 4096, 0)
+    sysfs._get_item('/dir1')
+
+    reply = sysfs._parse_line('RECORD STOP')
+    assert reply.split()[0] == 'OK'
+    tree, records = loads(decode_bytes(reply.split()[1]).decode())
+    assert decode_dict(tree) == TEST_ROOT
+    assert [r[1:] for r in records] == [
+        ('getattr', '/file1', ()),
+        ('read', '/file1', (4096, 0)),
+    ]
+    assert sysfs._recorder is None
+
+
+def test_parse_line_MEMORY():
+    sysfs = SysfsFuse()
+    sysfs._root = copy.deepcopy(TEST_ROOT)
+    sysfs.write('/file1', b'test', 0)
+
+    reply = sysfs._parse_line('MEMORY')
+    assert reply.split()[0] == 'OK'
+    usage = decode_dict(reply.split()[1])
+    assert usage['vmrss_bytes'] > 0
+    assert usage['structures']['write_data_items'] == 1
+    assert usage['structures']['write_data_bytes'] == 4
+    assert 'tracemalloc' not in usage
+
+    reply = sysfs._parse_line('MEMORY START')
+    assert reply.split() == ['OK']
+    try:
+        reply = sysfs._parse_line('MEMORY')
+        usage = decode_dict(reply.split()[1])
+        assert usage['tracemalloc']['current_bytes'] >= 0
+        assert isinstance(usage['tracemalloc']['top'], list)
+    finally:
+        reply = sysfs._parse_line('MEMORY STOP')
+    assert reply.split() == ['OK']
+
+    reply = sysfs._parse_line('MEMORY BOGUS')
+    assert reply.startswith('ERR ')
+
+
 def test_get_item():
     sysfs = SysfsFuse()
     sysfs._root = dict(TEST_ROOT)
@@ -87,6 +934,48 @@ def test_get_item():
     assert item is None
 
 
+def test_get_item_link():
+    sysfs = SysfsFuse()
+    sysfs._root = copy.deepcopy(TEST_ROOT)
+    dir2 = sysfs._root['contents'][0]['contents'][0]
+    dir2['contents'].append({
+        'name': 'link1',
+        'type': 'link',
+        'mode': 0o777,
+        'target': '../../file1',
+    })
+    dir2['contents'].append({
+        'name': 'loop',
+        'type': 'link',
+        'mode': 0o777,
+        'target': 'loop',
+    })
+    sysfs._root['contents'].append({
+        'name': 'link2',
+        'type': 'link',
+        'mode': 0o777,
+        'target': 'dir1/dir2',
+    })
+
+    # the last part of the path is not followed
+    item = sysfs._get_item('/dir1/dir2/link1')
+    assert item['type'] == 'link'
+
+    item = sysfs._get_item('/link2/link1')
+    assert item['type'] == 'link'
+
+    item = sysfs._get_item('/link2/loop/x')
+    assert item is None
+
+    attr = sysfs.getattr('/link2')
+    assert stat.S_IFMT(attr.st_mode) == stat.S_IFLNK
+    assert attr.st_size == len('dir1/dir2')
+
+    assert sysfs.readlink('/link2') == 'dir1/dir2'
+    assert sysfs.readlink('/file1') == -errno.EINVAL
+    assert sysfs.readlink('/file0') == -errno.ENOENT
+
+
 def test_getattr():
     sysfs = SysfsFuse()
     sysfs._root = copy.deepcopy(TEST_ROOT)
@@ -204,6 +1093,29 @@ def test_write():
     assert ret == -errno.ENOENT
 
 
+def test_write_rules():
+    sysfs = SysfsFuse()
+    sysfs._root = copy.deepcopy(TEST_ROOT)
+    rules = [{
+        'path': '/file*',
+        'value': 'reset',
+        'set': {'file1': '0'},
+        'notify': {'/file1': select.POLLPRI},
+    }]
+    reply = sysfs._parse_line('RULES {}'.format(encode_dict(rules)))
+    assert reply.split() == ['OK']
+
+    item = sysfs._root['contents'][1]
+    ret = sysfs.write('/file1', b'run\n', 0)
+    assert ret == 4
+    assert decode_bytes(item['contents']) == ALL_BYTES
+
+    ret = sysfs.write('/file1', b'reset\n', 0)
+    assert ret == 6
+    assert decode_bytes(item['contents']) == b'0\n'
+    assert item['poll_events'] == select.POLLPRI
+
+
 def test_truncate():
     sysfs = SysfsFuse()
     sysfs._root = copy.deepcopy(TEST_ROOT)
@@ -232,3 +1144,14 @@ def test_poll():
     ret = sysfs.poll('/file1', poll_handle)
     assert ret == 1
     assert '/file1' not in sysfs._poll_handles
+
+
+def test_poll_unchanged():
+    sysfs = SysfsFuse()
+    sysfs._parse_line('BASE SET ' + encode_dict(TEST_ROOT))
+
+    # polling a file without events doesn't change it
+    generation = sysfs._generation
+    assert sysfs.poll('/file1', object()) == 0
+    assert sysfs._generation == generation
+    assert not sysfs._owned
@@ -1,12 +1,20 @@
+import copy
 import errno
+import os
+import re
 import select
+import signal
 import stat
+import threading
+import time
 
 from pathlib import Path
 
 import pytest
 
 from ev3dev.testfs import encode_bytes, decode_bytes, Sysfs
+from ev3dev.testfs._recorder import loads
+from ev3dev.testfs._util import decode_dict
 
 
 ALL_BYTES = bytes(range(256))
@@ -157,3 +165,476 @@ def test_sysfs_poll_file1(tmp_path: Path):
                 assert events == select.POLLIN | select.POLLERR
                 ok = True
             assert ok  # timed out if not ok
+
+
+def test_sysfs_replay(tmp_path: Path):
+    mount_point = tmp_path.joinpath('mnt')
+    mount_point.mkdir()
+    trace = tmp_path.joinpath('trace.csv')
+    trace.write_text('time,value0\n0.0,1\n0.2,2\n')
+
+    with Sysfs(mount_point) as sysfs:
+        tree = copy.deepcopy(TEST_ROOT)
+        tree['contents'][0]['contents'].append({
+            'name': 'value0',
+            'type': 'file',
+            'mode': 0o444,
+            'contents': '',
+        })
+        sysfs.tree = tree
+
+        value0 = mount_point.joinpath('dir1', 'value0')
+        with open(value0, 'rb') as f:
+            p = select.poll()
+            p.register(f.fileno(), select.POLLPRI)
+
+            sysfs.replay('/dir1', str(trace))
+
+            # each sample sends POLLPRI
+            for expected in (b'1\n', b'2\n'):
+                ok = False
+                for fd, events in p.poll(1000):
+                    assert events & select.POLLPRI
+                    ok = True
+                assert ok  # timed out if not ok
+                assert value0.read_bytes() == expected
+
+        sysfs.stop_replay('/dir1')
+
+
+def test_sysfs_replay_bad_path(tmp_path: Path):
+    with Sysfs(tmp_path) as sysfs:
+        with pytest.raises(IOError) as exc_info:
+            sysfs.replay('/dir1', 'trace.csv')
+        assert 'Not a valid directory path' in str(exc_info.value)
+
+
+def test_sysfs_generator(tmp_path: Path):
+    with Sysfs(tmp_path) as sysfs:
+        sysfs.tree = TEST_ROOT
+        sysfs.set_generator('/file1', 'ramp', 100, notify=True, slope=100)
+
+        file1 = tmp_path.joinpath('file1')
+        with open(file1, 'rb') as f:
+            p = select.poll()
+            p.register(f.fileno(), select.POLLPRI)
+            first = int(file1.read_bytes())
+
+            ok = False
+            for fd, events in p.poll(500):
+                assert events & select.POLLPRI
+                ok = True
+            assert ok  # timed out if not ok
+            assert int(file1.read_bytes()) > first
+
+        sysfs.clear_generator('/file1')
+        assert file1.read_bytes() == ALL_BYTES
+
+
+def test_sysfs_generator_bad_kind(tmp_path: Path):
+    with Sysfs(tmp_path) as sysfs:
+        sysfs.tree = TEST_ROOT
+        with pytest.raises(IOError):
+            sysfs.set_generator('/file1', 'triangle', 10)
+
+
+def test_sysfs_callback(tmp_path: Path):
+    with Sysfs(tmp_path) as sysfs:
+        sysfs.tree = TEST_ROOT
+        sysfs.register_callback('counter', expression='count')
+        sysfs.set_callback('/file1', 'counter')
+
+        file1 = tmp_path.joinpath('file1')
+        assert file1.read_bytes() == b'0\n'
+        assert file1.read_bytes() == b'1\n'
+
+        sysfs.clear_callback('/file1')
+        assert file1.read_bytes() == ALL_BYTES
+
+
+def test_sysfs_rules(tmp_path: Path):
+    with Sysfs(tmp_path) as sysfs:
+        sysfs.tree = TEST_ROOT
+        sysfs.set_rules([{'path': '/file2', 'set': {'file2': '{value}!'}}])
+
+        file2 = tmp_path.joinpath('file2')
+        file2.write_bytes(b'test')
+        assert file2.read_bytes() == b'test!\n'
+
+
+def test_sysfs_clock(tmp_path: Path):
+    mount_point = tmp_path.joinpath('mnt')
+    mount_point.mkdir()
+    trace = tmp_path.joinpath('trace.csv')
+    trace.write_text('0,1\n30,2\n60,3\n')
+
+    with Sysfs(mount_point) as sysfs:
+        tree = copy.deepcopy(TEST_ROOT)
+        tree['contents'][0]['contents'].append({
+            'name': 'value0',
+            'type': 'file',
+            'mode': 0o444,
+            'contents': '',
+        })
+        sysfs.tree = tree
+        value0 = mount_point.joinpath('dir1', 'value0')
+
+        sysfs.pause_clock()
+        start = sysfs.clock_time
+        sysfs.replay('/dir1', str(trace))
+        sysfs.step_clock(0)
+        assert value0.read_bytes() == b'1\n'
+        sysfs.step_clock(30000)
+        assert value0.read_bytes() == b'2\n'
+        assert sysfs.clock_time == start + 30
+
+        # 30 seconds of trace should not take 30 seconds
+        sysfs.fast_forward_clock()
+        for _ in range(50):
+            if value0.read_bytes() == b'3\n':
+                break
+            time.sleep(0.01)
+        assert value0.read_bytes() == b'3\n'
+
+        sysfs.run_clock(2)
+
+
+def test_sysfs_hotplug(tmp_path: Path):
+    with Sysfs(tmp_path) as sysfs:
+        sysfs.tree = TEST_ROOT
+        device = {
+            'type': 'directory',
+            'mode': 0o755,
+            'contents': [{
+                'name': 'value0',
+                'type': 'file',
+                'mode': 0o444,
+                'contents': encode_bytes(b'1\n'),
+            }],
+        }
+        mtime = tmp_path.joinpath('dir1').stat().st_mtime
+
+        sysfs.add_device('/dir1/dev0', device, link='/dir1/dir2/dev0')
+        # attributes are not cached, so the new mtime is seen right away
+        assert tmp_path.joinpath('dir1').stat().st_mtime > mtime
+        link = tmp_path.joinpath('dir1', 'dir2', 'dev0')
+        assert link.is_symlink()
+        assert link.joinpath('value0').read_bytes() == b'1\n'
+
+        with open(link.joinpath('value0'), 'rb') as f:
+            p = select.poll()
+            p.register(f.fileno(), select.POLLPRI)
+            sysfs.remove_device('/dir1/dev0', link='/dir1/dir2/dev0')
+
+            ok = False
+            for fd, events in p.poll(500):
+                assert events & select.POLLERR
+                ok = True
+            assert ok  # timed out if not ok
+
+        assert not link.exists()
+        ls = [x.name for x in tmp_path.joinpath('dir1').iterdir()]
+        assert 'dev0' not in ls
+
+
+def test_sysfs_lazy_directory(tmp_path: Path):
+    with Sysfs(tmp_path) as sysfs:
+        sysfs.register_template('device', {
+            'type': 'directory',
+            'mode': 0o755,
+            'contents': [{
+                'name': 'address',
+                'type': 'file',
+                'mode': 0o444,
+                'contents': encode_bytes(b'{address}\n'),
+            }],
+        })
+        tree = copy.deepcopy(TEST_ROOT)
+        tree['contents'].append({
+            'name': 'dev0',
+            'type': 'directory',
+            'mode': 0o755,
+            'lazy': {'template': 'device', 'params': {'address': 'in1'}},
+        })
+        sysfs.tree = tree
+
+        dev0 = tmp_path.joinpath('dev0')
+        assert dev0.joinpath('address').read_bytes() == b'in1\n'
+        assert [x.name for x in dev0.iterdir()] == ['address']
+
+
+def test_sysfs_stats(tmp_path: Path):
+    with Sysfs(tmp_path) as sysfs:
+        sysfs.tree = TEST_ROOT
+        sysfs.stats(reset=True)
+
+        tmp_path.joinpath('file1').read_bytes()
+        stats = sysfs.stats()
+        assert stats['read']['count'] >= 1
+        assert stats['open']['count'] >= 1
+        assert 'SET' not in stats
+
+
+def test_sysfs_tracing(tmp_path: Path):
+    with Sysfs(tmp_path) as sysfs:
+        sysfs.tree = TEST_ROOT
+        sysfs.start_tracing()
+
+        tmp_path.joinpath('file1').read_bytes()
+        trace = sysfs.get_trace()
+        names = [e['name'] for e in trace['traceEvents']]
+        assert 'open' in names
+        assert 'read' in names
+
+        sysfs.stop_tracing()
+        with pytest.raises(IOError):
+            sysfs.get_trace()
+
+
+def test_sysfs_profiling(tmp_path: Path):
+    with Sysfs(tmp_path) as sysfs:
+        sysfs.tree = TEST_ROOT
+        sysfs.start_profiling(0.1)
+
+        file1 = tmp_path.joinpath('file1')
+        for _ in range(100):
+            file1.read_bytes()
+
+        result = sysfs.stop_profiling()
+        assert result['samples'] > 0
+        # the main thread only waits in the FUSE main loop
+        assert not any(s.startswith('MainThread;') for s in result['stacks'])
+        with pytest.raises(IOError):
+            sysfs.stop_profiling()
+
+
+def test_sysfs_item_access(tmp_path: Path):
+    with Sysfs(tmp_path) as sysfs:
+        sysfs.tree = TEST_ROOT
+
+        assert sysfs['/file1'] == ALL_BYTES
+        with pytest.raises(KeyError):
+            sysfs['/file3']
+
+        sysfs['/file2'] = b'test'
+        assert tmp_path.joinpath('file2').read_bytes() == b'test'
+        sysfs['/dir1/file3'] = b'new'
+        assert tmp_path.joinpath('dir1', 'file3').read_bytes() == b'new'
+
+        assert '/dir1/file3' in sysfs
+        del sysfs['/dir1/file3']
+        assert '/dir1/file3' not in sysfs
+        with pytest.raises(KeyError):
+            del sysfs['/dir1/file3']
+
+
+def test_sysfs_item_access_timeout(tmp_path: Path):
+    with Sysfs(tmp_path) as sysfs:
+        sysfs.tree = TEST_ROOT
+
+        # a server that does not reply is not the same as a missing path
+        os.kill(sysfs._p.pid, signal.SIGSTOP)
+        try:
+            with pytest.raises(TimeoutError):
+                sysfs['/file3']
+            with pytest.raises(TimeoutError):
+                del sysfs['/file3']
+        finally:
+            os.kill(sysfs._p.pid, signal.SIGCONT)
+        assert sysfs['/file1'] == ALL_BYTES
+
+
+def test_sysfs_get_set_many(tmp_path: Path):
+    with Sysfs(tmp_path) as sysfs:
+        sysfs.tree = TEST_ROOT
+
+        sysfs.set_many({'/file1': b'1\n', '/file2': b'2\n'})
+        assert tmp_path.joinpath('file1').read_bytes() == b'1\n'
+        assert sysfs.get_many(['/file1', '/file2']) == {
+            '/file1': b'1\n',
+            '/file2': b'2\n',
+        }
+        with pytest.raises(IOError):
+            sysfs.set_many({'/file1': b'3\n', '/file3': b'3\n'})
+        assert sysfs['/file1'] == b'1\n'
+
+
+def test_sysfs_snapshot(tmp_path: Path):
+    with Sysfs(tmp_path) as sysfs:
+        sysfs.tree = TEST_ROOT
+        sysfs.snapshot('start')
+        tree = sysfs.tree
+
+        tmp_path.joinpath('file2').write_bytes(b'test\n')
+        sysfs['/file1'] = b'1\n'
+        sysfs['/dir1/file3'] = b'3\n'
+        sysfs.restore('start')
+        assert sysfs.tree == tree
+        assert tmp_path.joinpath('file1').read_bytes() == ALL_BYTES
+        assert not tmp_path.joinpath('dir1', 'file3').exists()
+
+        sysfs.drop_snapshot('start')
+        with pytest.raises(IOError):
+            sysfs.restore('start')
+
+
+def test_sysfs_base(tmp_path: Path):
+    with Sysfs(tmp_path) as sysfs:
+        with pytest.raises(IOError):
+            sysfs.reset()
+
+        sysfs.set_base(TEST_ROOT)
+        assert sysfs.tree == TEST_ROOT
+        tmp_path.joinpath('file2').write_bytes(b'test\n')
+        sysfs['/file1'] = b'1\n'
+        sysfs.reset()
+        assert sysfs['/file1'] == ALL_BYTES
+        assert 'write_data' not in sysfs.get_subtree('/file2')
+
+        # the same base again only drops the changes
+        sysfs['/file1'] = b'1\n'
+        sysfs.set_base(copy.deepcopy(TEST_ROOT))
+        assert sysfs.tree == TEST_ROOT
+
+        sysfs.set_base(dict(TEST_ROOT, contents=[]))
+        assert not tmp_path.joinpath('file1').exists()
+
+
+def test_sysfs_wait_for_write(tmp_path: Path):
+    with Sysfs(tmp_path) as sysfs:
+        sysfs.tree = TEST_ROOT
+        file2 = tmp_path.joinpath('file2')
+
+        def write():
+            time.sleep(0.1)
+            file2.write_bytes(b'stop\n')
+            file2.write_bytes(b'run-forever\n')
+
+        thread = threading.Thread(target=write)
+        thread.start()
+        assert sysfs.wait_for_write('/file2', 'run-forever') == \
+            b'run-forever\n'
+        thread.join()
+
+        thread = threading.Thread(target=write)
+        thread.start()
+        assert sysfs.wait_for_write('/file2', re.compile(b'st.p\n')) == \
+            b'stop\n'
+        thread.join()
+
+        with pytest.raises(TimeoutError):
+            sysfs.wait_for_write('/file2', timeout=0.1)
+        with pytest.raises(TypeError):
+            sysfs.wait_for_write('/file2', lambda data: True)
+
+
+def test_sysfs_get_subtree(tmp_path: Path):
+    with Sysfs(tmp_path) as sysfs:
+        sysfs.tree = TEST_ROOT
+
+        assert sysfs.get_subtree('/dir1') == TEST_ROOT['contents'][0]
+        dir1 = sysfs.get_subtree('/dir1', depth=0)
+        assert dir1['name'] == 'dir1'
+        assert 'contents' not in dir1
+        with pytest.raises(IOError):
+            sysfs.get_subtree('/file3')
+
+
+def test_sysfs_tree_cache(tmp_path: Path):
+    with Sysfs(tmp_path) as sysfs:
+        sysfs.tree = TEST_ROOT
+        tree = sysfs.tree
+        assert tree == TEST_ROOT
+        tree['contents'].clear()
+        assert sysfs.tree == TEST_ROOT
+
+        tmp_path.joinpath('file2').write_bytes(b'test')
+        file2 = sysfs.tree['contents'][2]
+        assert decode_bytes(file2['write_data']) == b'test'
+
+
+def test_sysfs_sync_tree(tmp_path: Path):
+    with Sysfs(tmp_path) as sysfs:
+        sysfs.tree = TEST_ROOT
+        tree = sysfs.sync_tree()
+        assert tree == TEST_ROOT
+
+        tmp_path.joinpath('file2').write_bytes(b'test')
+        sysfs['/dir1/file3'] = b'new'
+        tree = sysfs.sync_tree()
+        assert decode_bytes(tree['contents'][2]['write_data']) == b'test'
+        assert tree == sysfs.tree
+
+
+def test_sysfs_threads(tmp_path: Path):
+    with Sysfs(tmp_path) as sysfs:
+        sysfs.tree = TEST_ROOT
+        errors = []
+
+        def worker(n):
+            try:
+                for i in range(50):
+                    path = '/dir1/file{}'.format(n)
+                    value = '{} {}'.format(n, i).encode()
+                    sysfs[path] = value
+                    assert sysfs[path] == value
+            except Exception as ex:
+                errors.append(ex)
+
+        threads = [threading.Thread(target=worker, args=(n,))
+                   for n in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert errors == []
+
+
+def test_sysfs_wait_in_thread(tmp_path: Path):
+    with Sysfs(tmp_path) as sysfs:
+        sysfs.tree = TEST_ROOT
+        written = []
+
+        thread = threading.Thread(target=lambda: written.append(
+            sysfs.wait_for_write('/file2', 'go', timeout=5)))
+        thread.start()
+        # other commands are not held up by the waiting thread
+        time.sleep(0.1)
+        for _ in range(10):
+            assert sysfs['/file1'] == ALL_BYTES
+        tmp_path.joinpath('file2').write_bytes(b'go\n')
+        thread.join()
+        assert written == [b'go\n']
+
+
+def test_sysfs_memory_usage(tmp_path: Path):
+    with Sysfs(tmp_path) as sysfs:
+        sysfs.tree = TEST_ROOT
+        sysfs.trace_allocations()
+
+        tmp_path.joinpath('file2').write_bytes(b'test')
+        usage = sysfs.memory_usage()
+        assert usage['vmrss_bytes'] > 0
+        assert usage['structures']['write_data_bytes'] == 4
+        assert 'top' in usage['tracemalloc']
+
+        sysfs.trace_allocations(False)
+        assert 'tracemalloc' not in sysfs.memory_usage()
+
+
+def test_sysfs_recording(tmp_path: Path):
+    mount_point = tmp_path.joinpath('mnt')
+    mount_point.mkdir()
+    log = tmp_path.joinpath('client.log')
+
+    with Sysfs(mount_point) as sysfs:
+        sysfs.tree = TEST_ROOT
+        sysfs.start_recording()
+        mount_point.joinpath('file2').write_bytes(b'test')
+        sysfs.stop_recording(str(log))
+
+    tree, records = loads(log.read_text())
+    assert decode_dict(tree) == TEST_ROOT
+    ops = [(op, path) for _, op, path, _ in records]
+    assert ('open', '/file2') in ops
+    assert ('write', '/file2') in ops
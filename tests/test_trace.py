@@ -0,0 +1,107 @@
+from pathlib import Path
+
+import pytest
+
+from ev3dev.testfs._clock import Clock
+from ev3dev.testfs._sched import Scheduler
+from ev3dev.testfs._trace import read_csv, Replay
+
+
+TRACE = """time,value0,value1
+0.0,1,10
+0.5,2,20
+1.0,3,30
+"""
+
+
+def paused_scheduler():
+    return Scheduler(Clock(speed=0))
+
+
+def test_read_csv(tmp_path: Path):
+    trace = tmp_path.joinpath('trace.csv')
+    trace.write_text(TRACE)
+
+    samples = list(read_csv(str(trace)))
+    assert samples == [(0.0, ['1', '10']), (0.5, ['2', '20']),
+                       (1.0, ['3', '30'])]
+
+
+def test_read_csv_bad_row(tmp_path: Path):
+    trace = tmp_path.joinpath('trace.csv')
+    trace.write_text('0,1\nbad,2\n')
+
+    with pytest.raises(ValueError):
+        list(read_csv(str(trace)))
+
+
+def test_replay(tmp_path: Path):
+    trace = tmp_path.joinpath('trace.csv')
+    trace.write_text(TRACE)
+    scheduler = paused_scheduler()
+    samples = []
+
+    replay = Replay(scheduler, str(trace), samples.append, speed=2.0)
+    replay.start()
+    assert replay.running
+
+    scheduler.run_pending()
+    assert samples == [['1', '10']]
+
+    scheduler.clock.advance_to(0.25)
+    scheduler.run_pending()
+    assert samples == [['1', '10'], ['2', '20']]
+
+    scheduler.clock.advance_to(0.5)
+    scheduler.run_pending()
+    assert samples == [['1', '10'], ['2', '20'], ['3', '30']]
+    assert not replay.running
+
+
+def test_replay_loop(tmp_path: Path):
+    trace = tmp_path.joinpath('trace.csv')
+    trace.write_text(TRACE)
+    scheduler = paused_scheduler()
+    samples = []
+
+    replay = Replay(scheduler, str(trace), samples.append, loop=True)
+    replay.start()
+    scheduler.clock.advance_to(1.0)
+    scheduler.run_pending()
+    assert len(samples) == 4
+    assert replay.running
+
+    replay.stop()
+    scheduler.clock.advance_to(5.0)
+    scheduler.run_pending()
+    assert len(samples) == 4
+    assert not replay.running
+
+
+def test_replay_stop_while_applying(tmp_path: Path, capsys):
+    trace = tmp_path.joinpath('trace.csv')
+    trace.write_text(TRACE)
+    scheduler = paused_scheduler()
+    samples = []
+
+    def callback(values):
+        samples.append(values)
+        # like stop() on the control thread while a sample is applied
+        replay.stop()
+
+    replay = Replay(scheduler, str(trace), callback)
+    replay.start()
+    scheduler.run_pending()
+    assert samples == [['1', '10']]
+    assert not replay.running
+    # the scheduler prints errors from callbacks
+    assert capsys.readouterr().err == ''
+
+    scheduler.clock.advance_to(5.0)
+    scheduler.run_pending()
+    assert samples == [['1', '10']]
+
+
+def test_replay_speed():
+    with pytest.raises(ValueError):
+        Replay(Scheduler(), 'trace.csv', print, speed=0)